@@ -0,0 +1,377 @@
+"""
+Micro benchmarks for the indexer and searcher components.
+
+Each benchmark is a sub command, run for instance:
+
+    python benchmark.py merge collections/pubmed_tiny.jsonl --blocks 50
+"""
+
+import argparse
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from cliutils import grouping_args
+from codec import encode_postings, parse_text_postings, index_filename
+from corpus_reader import Reader, JSON_BACKEND
+from indexer import InvertedIndex, SPIMIIndexer, CACHED_SMART_NOTATIONS
+from searcher import Searcher, HEAP_MAX_FRACTION
+from tokenizer import Tokenizer
+
+
+def add_index_arguments(parser):
+    parser.add_argument('path_to_collection', type=str, help='Collection used to build the index.')
+    parser.add_argument('--tokenizer.minL', type=int, default=3)
+    parser.add_argument('--tokenizer.stopwords_path', type=str, default=None)
+    parser.add_argument('--tokenizer.stemmer', type=str, default=None)
+    parser.add_argument('--tokenizer.regular_exp', type=str, default=None)
+    parser.add_argument('--tokenizer.lowercase', action="store_true", default=True)
+    parser.add_argument('--indexer.storing.store_term_position', action="store_true")
+    parser.add_argument('--indexer.storing.format', type=str, default="text")
+
+
+def read_documents(args):
+    reader = Reader(args.path_to_collection)
+    documents = []
+    while args.docs is None or len(documents) < args.docs:
+        pmid, content = reader.read()
+        if pmid is None:
+            break
+        documents.append(content)
+    return documents
+
+
+def legacy_merge(folder, positional, format):
+    """
+    Copy of the merge_blocks replaced by the heap k-way merge, kept as the baseline of the merge
+    benchmark. It picks the next block by the first character of its current line only, so it
+    writes terms out of order and keeps the postings of only one of the blocks that hold a term:
+    its output is not a valid index, only its time is meaningful. The dumps on the memory threshold
+    are left out and the lexicon entries are sorted but not written. Returns the number of terms.
+    """
+    files = {}
+    for block_id, path in enumerate(os.scandir(folder)):
+        if path.is_file() and path.name.startswith("block_"):
+            files[block_id] = open(path, "rb")
+    lines = {block_id: file.readline().decode("utf-8").strip() for block_id, file in files.items()}
+
+    temp_index = {}
+    saved_term = None
+    while files:
+        min_index = min(lines, key=lambda x: list(lines[x])[0])
+        current_term, current_postings = lines[min_index].split(';', 1)
+        if current_term != saved_term:
+            freq = 0
+            postings = current_postings.split(";")
+            for posting in postings:
+                if ':' in posting:
+                    _, positions = posting.split(':')
+                    freq += len(list(map(int, positions.split(','))))
+                else:
+                    freq += int(posting.split(',')[1])
+            temp_index[current_term] = (current_postings, len(postings), freq)
+            saved_term = current_term
+
+        lines[min_index] = files[min_index].readline().decode("utf-8")[:-1]
+        if lines[min_index] == "":
+            files.pop(min_index).close()
+            lines.pop(min_index)
+
+    lexicon = []
+    offset = 0
+    with open(os.path.join(folder, "legacy_" + index_filename(format)), "wb") as f:
+        for term, (postings, df, cf) in temp_index.items():
+            if format == "text":
+                line = f"{term};{postings}\n".encode("utf-8")
+            else:
+                line = encode_postings(term, parse_text_postings(postings), positional, format)
+            f.write(line)
+            lexicon.append((term, df, cf, offset, len(line)))
+            offset += len(line)
+    lexicon.sort()
+    return len(temp_index)
+
+
+def benchmark_merge(args):
+    """
+    Time of InvertedIndex.merge_blocks over a fixed number of SPIMI blocks, and of legacy_merge,
+    the merge it replaced, over the same blocks.
+    """
+    tokenizer = Tokenizer(args)
+    documents = read_documents(args)
+    docs_per_block = max(1, -(-len(documents) // args.blocks))
+
+    folder = tempfile.mkdtemp()
+    try:
+        inverted_index = InvertedIndex(folder, args.indexer.storing.store_term_position, args.indexer.storing.format)
+        for doc_id, content in enumerate(documents):
+            tokens = {}
+            for i, token in enumerate(tokenizer.tokenize(content)):
+                tokens.setdefault(token, []).append(i)
+            for token, positions in tokens.items():
+                inverted_index.add_term(token, doc_id, positions)
+            if (doc_id + 1) % docs_per_block == 0:
+                inverted_index.write_in_disk(folder)
+                inverted_index.clean_posting_list()
+        if inverted_index.posting_list:
+            inverted_index.write_in_disk(folder)
+            inverted_index.clean_posting_list()
+
+        blocks = inverted_index.block_counter
+        # the legacy merge leaves the blocks in place, merge_blocks deletes them
+        tic = time.time()
+        legacy_terms = legacy_merge(folder, args.indexer.storing.store_term_position, args.indexer.storing.format)
+        legacy = time.time() - tic
+
+        tic = time.time()
+        inverted_index.merge_blocks(folder)
+        toc = time.time()
+
+        print(f"documents: {len(documents)}")
+        print(f"blocks merged: {blocks}")
+        print(f"legacy merge time: {round(legacy, 3)} s ({legacy_terms} terms written)")
+        print(f"merge time: {round(toc - tic, 3)} s")
+    finally:
+        shutil.rmtree(folder)
+
+
+
+def benchmark_reader(args):
+    """Documents per second read from the collection one at a time and in batches."""
+    print(f"json backend: {JSON_BACKEND}")
+
+    reader = Reader(args.path_to_collection)
+    tic = time.time()
+    documents = 0
+    while reader.read()[0] is not None:
+        documents += 1
+    elapsed = time.time() - tic
+    print(f"read | documents: {documents} | {round(documents / elapsed)} docs/s")
+
+    reader = Reader(args.path_to_collection)
+    tic = time.time()
+    documents = sum(len(batch) for batch in reader.read_batches(args.batch_size))
+    elapsed = time.time() - tic
+    print(f"read_batches | documents: {documents} | {round(documents / elapsed)} docs/s")
+
+
+def benchmark_tokenizer(args):
+    """Tokens per second of the tokenizer over the collection, without and with stemming."""
+    documents = read_documents(args)
+    for stemmer in [None, "pystemmer"]:
+        setattr(args.tokenizer, "stemmer", stemmer)
+        tokenizer = Tokenizer(args)
+        tic = time.time()
+        tokens = 0
+        for content in documents:
+            tokens += len(tokenizer.tokenize(content))
+        elapsed = time.time() - tic
+        print(f"stemmer: {stemmer} | documents: {len(documents)} | tokens: {tokens} | {round(tokens / elapsed)} tokens/s")
+        if tokenizer.stem is not None:
+            info = tokenizer.stem.cache_info()
+            print(f"stem cache | hits: {info.hits} | misses: {info.misses}")
+
+
+def benchmark_workers(args):
+    """Indexing time of the whole collection with a growing number of worker processes."""
+    tokenizer = Tokenizer(args)
+    baseline = None
+    for workers in args.workers:
+        args.index_output_folder = tempfile.mkdtemp()
+        args.indexer.workers = workers
+        try:
+            indexer = SPIMIIndexer(tokenizer, args)
+            tic = time.time()
+            indexer.index()
+            elapsed = time.time() - tic
+        finally:
+            shutil.rmtree(args.index_output_folder)
+
+        baseline = baseline or elapsed
+        print(f"workers: {workers} | indexing time: {round(elapsed, 3)} s | speedup: {round(baseline / elapsed, 2)}x")
+
+
+
+def read_queries(path_to_queries):
+    with open(path_to_queries, 'r') as file:
+        return [json.loads(line)["query_text"] for line in file]
+
+
+def benchmark_topk(args):
+    """
+    Average time per query to select the top k documents from the scores of every scored document,
+    by sorting all of them, with a heap of size k (heapq.nlargest) and with Searcher.top_documents,
+    which picks one of the two from the number of scored documents (HEAP_MAX_FRACTION).
+    """
+    searcher = Searcher(args.index_folder)
+    queries = read_queries(args.path_to_queries)
+    key = lambda x: (x[1], -x[0])
+
+    searches = {
+        "bm25": lambda query: searcher.bm25_search(query, args.k1, args.b, None, pruning=False),
+        "tf-idf": lambda query: searcher.tf_idf_search(query, args.smart_notation, None),
+    }
+    for name, search in searches.items():
+        # the scores are computed once, only the selection of the top k is timed
+        all_scores = [dict(search(query)) for query in queries]
+        for top_k in args.top_k:
+            tic = time.time()
+            for doc_scores in all_scores * args.repeat:
+                sorted(doc_scores.items(), key=key, reverse=True)[:top_k]
+            sorting = (time.time() - tic) / (len(queries) * args.repeat)
+
+            tic = time.time()
+            for doc_scores in all_scores * args.repeat:
+                heapq.nlargest(top_k, doc_scores.items(), key=key)
+            heap = (time.time() - tic) / (len(queries) * args.repeat)
+
+            tic = time.time()
+            for doc_scores in all_scores * args.repeat:
+                searcher.top_documents(doc_scores, top_k)
+            selected = (time.time() - tic) / (len(queries) * args.repeat)
+            heap_queries = sum(top_k < HEAP_MAX_FRACTION * len(doc_scores) for doc_scores in all_scores)
+
+            print(f"{name} | k: {top_k} | sort all: {round(sorting * 1000, 3)} ms/query | heap: {round(heap * 1000, 3)} ms/query"
+                  f" | top_documents: {round(selected * 1000, 3)} ms/query (heap for {heap_queries}/{len(queries)} queries)")
+
+
+
+def benchmark_pruning(args):
+    """Postings scored and decoded per query and latency of bm25 with and without MaxScore pruning."""
+    # without the postings cache, so the second run decodes its postings like the first one
+    searcher = Searcher(args.index_folder, postings_cache_mb=0)
+    queries = read_queries(args.path_to_queries)
+
+    runs = {}
+    for pruning in [False, True]:
+        searcher.postings_evaluated = 0
+        searcher.postings_decoded = 0
+        tic = time.time()
+        runs[pruning] = [searcher.bm25_search(query, args.k1, args.b, args.top_k, pruning) for query in queries]
+        elapsed = (time.time() - tic) / len(queries)
+        print(f"pruning: {pruning} | postings evaluated: {round(searcher.postings_evaluated / len(queries), 1)} per query | decoded: {round(searcher.postings_decoded / len(queries), 1)} per query | {round(elapsed * 1000, 2)} ms/query")
+
+    same = sum([doc_id for doc_id, _ in a] == [doc_id for doc_id, _ in b] for a, b in zip(runs[False], runs[True]))
+    print(f"queries with identical results: {same}/{len(queries)}")
+
+
+def benchmark_engines(args):
+    """Batch latency of the python and numpy scoring engines, and how often both rank the same documents."""
+    queries = read_queries(args.path_to_queries)
+    searches = {
+        "bm25": lambda searcher, query: searcher.bm25_search(query, args.k1, args.b, args.top_k, pruning=False),
+        "tf-idf": lambda searcher, query: searcher.tf_idf_search(query, args.smart_notation, args.top_k),
+    }
+
+    for name, search in searches.items():
+        runs = {}
+        for engine in ["python", "numpy"]:
+            searcher = Searcher(args.index_folder, engine)
+            tic = time.time()
+            runs[engine] = [search(searcher, query) for query in queries]
+            elapsed = (time.time() - tic) / len(queries)
+            print(f"{name} | engine: {engine} | {round(elapsed * 1000, 2)} ms/query")
+
+        same = sum([doc_id for doc_id, _ in a] == [doc_id for doc_id, _ in b] for a, b in zip(runs["python"], runs["numpy"]))
+        print(f"{name} | queries with identical results: {same}/{len(queries)}")
+
+
+def benchmark_cache(args):
+    """Latency of repeated batch runs with the postings and results caches enabled and disabled."""
+    queries = read_queries(args.path_to_queries)
+    for postings_cache_mb, results_cache_mb in [(0, 0), (args.postings_cache_mb, 0), (args.postings_cache_mb, args.results_cache_mb)]:
+        searcher = Searcher(args.index_folder, postings_cache_mb=postings_cache_mb, results_cache_mb=results_cache_mb)
+        tic = time.time()
+        for _ in range(args.repeat):
+            for query in queries:
+                searcher.search(query, args.top_k, "bm25", "standard", None, None, args.k1, args.b)
+        elapsed = (time.time() - tic) / (len(queries) * args.repeat)
+        stats = searcher.cache_stats()
+        print(f"postings cache: {postings_cache_mb} MB | results cache: {results_cache_mb} MB | {round(elapsed * 1000, 2)} ms/query"
+              f" | postings hit rate: {stats['postings']['hit_rate']} | results hit rate: {stats['results']['hit_rate']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the IR engine")
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    merge_parser = benchmarks.add_parser('merge', help='Merge of the SPIMI blocks')
+    add_index_arguments(merge_parser)
+    merge_parser.add_argument('--docs', type=int, default=None, help='Maximum number of documents read from the collection.')
+    merge_parser.add_argument('--blocks', type=int, default=50, help='Number of blocks written before merging.')
+
+    reader_parser = benchmarks.add_parser('reader', help='Throughput of the collection reader')
+    reader_parser.add_argument('path_to_collection', type=str, help='Collection to read.')
+    reader_parser.add_argument('--batch_size', type=int, default=256, help='Documents per batch of read_batches.')
+
+    tokenizer_parser = benchmarks.add_parser('tokenizer', help='Throughput of the tokenizer with and without stemming')
+    add_index_arguments(tokenizer_parser)
+    tokenizer_parser.add_argument('--docs', type=int, default=None, help='Maximum number of documents read from the collection.')
+
+    workers_parser = benchmarks.add_parser('workers', help='Scaling of the parallel SPIMI indexing')
+    add_index_arguments(workers_parser)
+    workers_parser.add_argument('--indexer.memory_threshold', type=float, default=None)
+    workers_parser.add_argument('--indexer.posting_threshold', type=int, default=None)
+    workers_parser.add_argument('--indexer.append', action="store_true")
+    workers_parser.add_argument('--indexer.storing.bm25.cache_in_disk', action="store_true")
+    workers_parser.add_argument('--indexer.storing.bm25.k1', type=float, default=1.2)
+    workers_parser.add_argument('--indexer.storing.bm25.b', type=float, default=0.7)
+    workers_parser.add_argument('--indexer.storing.tfidf.cache_in_disk', action="store_true")
+    workers_parser.add_argument('--indexer.storing.tfidf.smart', type=str, default="lnc.ltc", choices=CACHED_SMART_NOTATIONS)
+    workers_parser.add_argument('--workers', type=int, nargs="+", default=[1, 2, 4, 8], help='Number of workers of each run.')
+
+    topk_parser = benchmarks.add_parser('topk', help='Time to select the top k documents with a heap or by sorting, for several values of k')
+    topk_parser.add_argument('index_folder', type=str, help='Folder where the index files are located.')
+    topk_parser.add_argument('path_to_queries', type=str, help='File with one json query (query_text) per line.')
+    topk_parser.add_argument('--top_k', type=int, nargs="+", default=[10, 100, 1000])
+    topk_parser.add_argument('--repeat', type=int, default=20, help='Number of times the selection is timed over every query.')
+    topk_parser.add_argument('--k1', type=float, default=1.2)
+    topk_parser.add_argument('--b', type=float, default=0.75)
+    topk_parser.add_argument('--smart_notation', type=str, default="lnc.ltc")
+
+    pruning_parser = benchmarks.add_parser('pruning', help='Postings evaluated by bm25 with and without MaxScore')
+    pruning_parser.add_argument('index_folder', type=str, help='Folder where the index files are located.')
+    pruning_parser.add_argument('path_to_queries', type=str, help='File with one json query (query_text) per line.')
+    pruning_parser.add_argument('--top_k', type=int, default=10)
+    pruning_parser.add_argument('--k1', type=float, default=1.2)
+    pruning_parser.add_argument('--b', type=float, default=0.75)
+
+    engines_parser = benchmarks.add_parser('engines', help='Latency of the python and numpy scoring engines')
+    engines_parser.add_argument('index_folder', type=str, help='Folder where the index files are located.')
+    engines_parser.add_argument('path_to_queries', type=str, help='File with one json query (query_text) per line.')
+    engines_parser.add_argument('--top_k', type=int, default=10)
+    engines_parser.add_argument('--k1', type=float, default=1.2)
+    engines_parser.add_argument('--b', type=float, default=0.75)
+    engines_parser.add_argument('--smart_notation', type=str, default="lnc.ltc")
+
+    cache_parser = benchmarks.add_parser('cache', help='Effect of the postings and results caches of the searcher')
+    cache_parser.add_argument('index_folder', type=str, help='Folder where the index files are located.')
+    cache_parser.add_argument('path_to_queries', type=str, help='File with one json query (query_text) per line.')
+    cache_parser.add_argument('--repeat', type=int, default=3, help='Number of times the queries are run.')
+    cache_parser.add_argument('--postings_cache_mb', type=float, default=64)
+    cache_parser.add_argument('--results_cache_mb', type=float, default=16)
+    cache_parser.add_argument('--top_k', type=int, default=10)
+    cache_parser.add_argument('--k1', type=float, default=1.2)
+    cache_parser.add_argument('--b', type=float, default=0.75)
+
+    args = grouping_args(parser.parse_args())
+
+    if args.benchmark == "merge":
+        benchmark_merge(args)
+    elif args.benchmark == "reader":
+        benchmark_reader(args)
+    elif args.benchmark == "tokenizer":
+        benchmark_tokenizer(args)
+    elif args.benchmark == "workers":
+        benchmark_workers(args)
+    elif args.benchmark == "topk":
+        benchmark_topk(args)
+    elif args.benchmark == "pruning":
+        benchmark_pruning(args)
+    elif args.benchmark == "engines":
+        benchmark_engines(args)
+    elif args.benchmark == "cache":
+        benchmark_cache(args)
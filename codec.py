@@ -0,0 +1,253 @@
+"""
+Encoding and decoding of the postings lists stored in the index.
+
+A postings list is handled as a list of (doc_id, positions, freq) tuples,
+sorted by doc_id, where positions is an empty list when the index is not
+positional.
+
+Supported formats:
+    text   - term;doc_id,freq;... or term;doc_id:p1,p2;... (one line per term)
+    varint - binary, doc id and position gaps written as variable-byte integers
+    gamma  - binary, doc id and position gaps written as Elias-gamma codes
+
+In the text format the bytes stored in the index are the whole line,
+including the term and the line break.
+
+In both binary formats the postings are split in blocks of BLOCK_SIZE
+postings. The data of a term starts with a header, always written as
+variable-byte integers: the number of postings, the number of blocks and
+one skip entry per block (gap between the last doc id of the block and
+the last doc id of the previous one, size of the block in bytes, highest
+frequency and shortest document length inside the block). The blocks
+follow, each one encoded on its own (varint or gamma, padded to a whole
+byte) as, for each posting, the doc id gap, the frequency and (if
+positional) the position gaps, the first gap being relative to the last
+doc id of the previous block. The skip entries let a reader jump to the
+block that holds a doc id, or bound the scores of a block, without
+decoding the blocks before it.
+"""
+
+FORMATS = ["text", "varint", "gamma"]
+
+BLOCK_SIZE = 128
+
+
+def index_filename(format, segment=0):
+    """Postings file of the base index (segment 0) or of the delta segment added by the segment-th append."""
+    extension = "txt" if format == "text" else "bin"
+    return f"index.{extension}" if segment == 0 else f"index_{segment}.{extension}"
+
+
+############
+##  text  ##
+############
+
+def parse_text_postings(postings_str):
+    postings = []
+    for posting in postings_str.split(';'):
+        if ':' in posting:  # Positional
+            doc_id, positions = posting.split(':')
+            positions = list(map(int, positions.split(',')))
+            postings.append((int(doc_id), positions, len(positions)))
+        else:  # Non-positional
+            doc_id, freq = posting.split(',')
+            postings.append((int(doc_id), [], int(freq)))
+    return postings
+
+
+def format_text_postings(postings, positional):
+    if positional:
+        return ';'.join([f"{doc_id}:{','.join(map(str, positions))}" for doc_id, positions, _ in postings])
+    return ';'.join([f"{doc_id},{freq}" for doc_id, _, freq in postings])
+
+
+###################
+##  gap encoding ##
+###################
+
+def _to_gaps(postings, positional, last_doc_id=0):
+    """Flattens a postings list into the sequence of integers that is written to disk."""
+    numbers = []
+    for doc_id, positions, freq in postings:
+        numbers.append(doc_id - last_doc_id)
+        numbers.append(freq)
+        last_doc_id = doc_id
+        if positional:
+            last_position = 0
+            for position in positions:
+                numbers.append(position - last_position)
+                last_position = position
+    return numbers
+
+
+def _from_gaps(numbers, positional, doc_id=0):
+    postings = []
+    i = 0
+    while i < len(numbers):
+        doc_id += numbers[i]
+        freq = numbers[i + 1]
+        i += 2
+        positions = []
+        if positional:
+            position = 0
+            for gap in numbers[i:i + freq]:
+                position += gap
+                positions.append(position)
+            i += freq
+        postings.append((doc_id, positions, freq))
+    return postings
+
+
+##############
+##  varint  ##
+##############
+
+def varint_encode(numbers):
+    out = bytearray()
+    for n in numbers:
+        while n >= 128:
+            out.append((n & 127) | 128)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+
+def varint_decode(data):
+    numbers = []
+    n = 0
+    shift = 0
+    for byte in data:
+        if byte < 128:
+            numbers.append(n | (byte << shift))
+            n = 0
+            shift = 0
+        else:
+            n |= (byte & 127) << shift
+            shift += 7
+    return numbers
+
+
+def varint_decode_prefix(data, count, pos=0):
+    """Decodes the first count integers starting at pos, returning them and the position after them."""
+    numbers = []
+    n = 0
+    shift = 0
+    while len(numbers) < count:
+        byte = data[pos]
+        pos += 1
+        if byte < 128:
+            numbers.append(n | (byte << shift))
+            n = 0
+            shift = 0
+        else:
+            n |= (byte & 127) << shift
+            shift += 7
+    return numbers, pos
+
+
+#############
+##  gamma  ##
+#############
+
+def gamma_encode(numbers):
+    # gamma codes can not represent 0, so every number is shifted by one
+    bits = []
+    for n in numbers:
+        binary = bin(n + 1)[2:]
+        bits.append('0' * (len(binary) - 1))
+        bits.append(binary)
+    bits = ''.join(bits)
+    bits += '0' * (-len(bits) % 8)
+    return int(bits, 2).to_bytes(len(bits) // 8, 'big') if bits else b''
+
+
+def gamma_decode(data):
+    bits = bin(int.from_bytes(data, 'big'))[2:].zfill(len(data) * 8)
+    numbers = []
+    pos = 0
+    end = len(bits)
+    while pos < end:
+        one = bits.find('1', pos)
+        if one == -1:  # only padding left
+            break
+        length = one - pos
+        numbers.append(int(bits[one:one + length + 1], 2) - 1)
+        pos = one + length + 1
+    return numbers
+
+
+##############
+##  blocks  ##
+##############
+
+def read_skips(data):
+    """
+    Reads the header of the binary postings of a term, returning the number of
+    postings and one (last_doc_id, start, end, max_tf, min_doc_len) tuple per
+    block, where start and end are the byte range of the block inside data.
+    """
+    (n_postings, n_blocks), pos = varint_decode_prefix(data, 2)
+    entries, pos = varint_decode_prefix(data, 4 * n_blocks, pos)
+    skips = []
+    last_doc_id = 0
+    for i in range(0, len(entries), 4):
+        doc_gap, size, max_tf, min_doc_len = entries[i:i + 4]
+        last_doc_id += doc_gap
+        skips.append((last_doc_id, pos, pos + size, max_tf, min_doc_len))
+        pos += size
+    return n_postings, skips
+
+
+def decode_block(data, skips, block, positional, format):
+    """Decodes the postings of one block, given the skips returned by read_skips."""
+    _, start, end, _, _ = skips[block]
+    base_doc_id = skips[block - 1][0] if block > 0 else 0
+    numbers = varint_decode(data[start:end]) if format == "varint" else gamma_decode(data[start:end])
+    return _from_gaps(numbers, positional, base_doc_id)
+
+
+def _encode_blocks(postings, positional, format, docs_len):
+    encode = varint_encode if format == "varint" else gamma_encode
+    header = [len(postings), 0]
+    blocks = []
+    last_doc_id = 0
+    for start in range(0, len(postings), BLOCK_SIZE):
+        block = postings[start:start + BLOCK_SIZE]
+        data = encode(_to_gaps(block, positional, last_doc_id))
+        max_tf = max(freq for _, _, freq in block)
+        min_doc_len = min(docs_len[doc_id] for doc_id, _, _ in block) if docs_len else 0
+        header += [block[-1][0] - last_doc_id, len(data), max_tf, min_doc_len]
+        last_doc_id = block[-1][0]
+        blocks.append(data)
+    header[1] = len(blocks)
+    return varint_encode(header) + b''.join(blocks)
+
+
+##############
+##  codecs  ##
+##############
+
+def encode_postings(term, postings, positional, format, docs_len=None):
+    """
+    Encodes a postings list in one of the FORMATS, returning bytes. docs_len (length
+    of every document by doc id) is used for the skip entries of the binary formats.
+    """
+    if format == "text":
+        return f"{term};{format_text_postings(postings, positional)}\n".encode("utf-8")
+    elif format in ("varint", "gamma"):
+        return _encode_blocks(postings, positional, format, docs_len)
+    raise ValueError(f"Unknown index format {format}")
+
+
+def decode_postings(data, positional, format):
+    """Decodes the bytes written by encode_postings back into a postings list."""
+    if format == "text":
+        line = bytes(data).decode("utf-8").rstrip("\n")
+        return parse_text_postings(line.split(';', 1)[1])
+    elif format in ("varint", "gamma"):
+        _, skips = read_skips(data)
+        postings = []
+        for block in range(len(skips)):
+            postings += decode_block(data, skips, block, positional, format)
+        return postings
+    raise ValueError(f"Unknown index format {format}")
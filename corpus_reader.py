@@ -1,19 +1,160 @@
-from json import loads
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import threading
+
+try:
+    # orjson parses the documents several times faster, the standard library is used when it is not installed
+    from orjson import loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    from json import loads
+    JSON_BACKEND = "json"
+
+try:
+    # .zst collections can only be read when the zstandard package is installed
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# size of each read from the collection file, larger chunks stop fitting in the cpu caches and get slower
+READ_CHUNK_SIZE = 1 << 16
+# compressed collections: size of each decompressed chunk and how many chunks can be decompressed ahead of the reader
+DECOMPRESS_CHUNK_SIZE = 1 << 20
+DECOMPRESS_CHUNKS_AHEAD = 8
+
+
+def open_collection(path_to_collection: str):
+    """
+    Opens the collection for reading in binary mode. Collections compressed with gzip (.gz),
+    bzip2 (.bz2), xz (.xz) or zstandard (.zst) are decompressed while they are read, in a
+    background thread, so nothing is written to disk and decompression overlaps tokenization.
+    """
+    if path_to_collection.endswith(".gz"):
+        stream = gzip.open(path_to_collection, 'rb')
+    elif path_to_collection.endswith(".bz2"):
+        stream = bz2.open(path_to_collection, 'rb')
+    elif path_to_collection.endswith(".xz"):
+        stream = lzma.open(path_to_collection, 'rb')
+    elif path_to_collection.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("Reading .zst collections needs the zstandard package (pip install zstandard)")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path_to_collection, 'rb'), closefd=True)
+    else:
+        return open(path_to_collection, 'rb')
+    return io.BufferedReader(BackgroundDecompressor(stream), READ_CHUNK_SIZE)
+
+
+class BackgroundDecompressor(io.RawIOBase):
+    """
+    Raw binary stream over a decompressing file object, read by a background thread.
+    zlib, bz2, lzma and zstandard release the GIL while they decompress, so the
+    thread keeps up to DECOMPRESS_CHUNKS_AHEAD chunks ready while the main thread
+    parses and tokenizes the previous ones.
+    """
+
+    def __init__(self, stream):
+        self.chunks = queue.Queue(maxsize=DECOMPRESS_CHUNKS_AHEAD)
+        self.stopped = threading.Event()
+        self.chunk = b""
+        self.pos = 0
+        self.finished = False
+        self.thread = threading.Thread(target=self.decompress, args=(stream,), daemon=True)
+        self.thread.start()
+
+    def decompress(self, stream):
+        try:
+            with stream:
+                while not self.stopped.is_set():
+                    chunk = stream.read(DECOMPRESS_CHUNK_SIZE)
+                    self.put(chunk)
+                    if not chunk:
+                        break
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        # gives up when the reader was closed before the end of the collection
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.pos >= len(self.chunk):
+            if self.finished:
+                return 0
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self.finished = True
+                return 0
+            self.chunk = chunk
+            self.pos = 0
+        size = min(len(buffer), len(self.chunk) - self.pos)
+        buffer[:size] = self.chunk[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def close(self):
+        self.stopped.set()
+        super().close()
 
 
 class Reader:
 
     def __init__(self, path_to_collection: str) -> None:
         self.path_to_collection = path_to_collection
-        self.file = open(self.path_to_collection, 'rb')
+        self.file = open_collection(self.path_to_collection)
         print("\nReader initialized...\n")
 
     def read(self):
         line = self.file.readline()
 
-        if not line:    
+        if not line:
             self.file.close()
             return None, None
-        
+
         result = loads(line)
-        return int(result['pmid']), " ".join([result['title'], result['abstract']])
\ No newline at end of file
+        return int(result['pmid']), " ".join([result['title'], result['abstract']])
+
+    def read_batches(self, batch_size):
+        """
+        Yields lists of up to batch_size (pmid, text) documents. The file is read in chunks of
+        READ_CHUNK_SIZE bytes, split into lines with one call and parsed with one comprehension
+        per chunk, instead of one read and several python calls per document.
+        """
+        documents = []
+        pending = b""
+        while 1:
+            chunk = self.file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                lines = [pending]
+            else:
+                end = chunk.rfind(b"\n")
+                if end == -1:
+                    pending += chunk
+                    continue
+                lines = (pending + chunk[:end] if pending else chunk[:end]).split(b"\n")
+                pending = chunk[end + 1:]
+
+            documents += [(int(result['pmid']), " ".join([result['title'], result['abstract']]))
+                          for result in map(loads, filter(None, lines))]
+            for start in range(0, len(documents) - batch_size + 1, batch_size):
+                yield documents[start:start + batch_size]
+            documents = documents[len(documents) - len(documents) % batch_size:]
+
+            if not chunk:
+                break
+
+        if documents:
+            yield documents
+        self.file.close()
@@ -1,87 +1,273 @@
 import time
+import math
+import heapq
+import itertools
+import multiprocessing
+import queue
 import psutil
 import os
+import shutil
+from array import array
 from Stemmer import Stemmer
 from corpus_reader import Reader
+from lexicon import LexiconWriter, lexicon_filename
+from codec import encode_postings, parse_text_postings, index_filename
 from tokenizer import Tokenizer
 
+READ_BUFFER_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 23
+DOCS_PER_TASK = 256
+# tf-idf notations whose document weights can be cached by the indexer (--indexer.storing.tfidf.smart)
+CACHED_SMART_NOTATIONS = ["lnc.ltc", "bnn.bnc"]
+
+# rough size in memory, in bytes, of the python objects held by InvertedIndex.posting_list
+# (measured with tracemalloc), used to flush blocks at a predictable size
+TERM_SIZE = 250         # term string and its postings dict
+POSTING_SIZE = 40       # dict entry with the doc id and the frequency
+POSITIONS_SIZE = 40     # list that holds the positions of a posting
+POSITION_SIZE = 36      # each position inside that list
+
 class SPIMIIndexer:
 
     def __init__(self, tokenizer : Tokenizer, args) -> None:
         self.index_output_folder = args.index_output_folder
+        # with --indexer.append an existing index is kept and the new documents go to a delta segment
+        appending = args.indexer.append and os.path.exists(os.path.join(self.index_output_folder, "docs_info.txt"))
         if os.path.exists(self.index_output_folder):
-            for file in os.listdir(self.index_output_folder):
-                os.remove(os.path.join(self.index_output_folder, file))
+            if not appending:
+                for file in os.listdir(self.index_output_folder):
+                    os.remove(os.path.join(self.index_output_folder, file))
         else:
             os.mkdir(self.index_output_folder)
         self.memory_threshold = args.indexer.memory_threshold if args.indexer.memory_threshold else 0.8
+        self.posting_threshold = args.indexer.posting_threshold
+        self.workers = args.indexer.workers
+        # the memory threshold is turned once into a budget of bytes for the postings held by each
+        # (worker) inverted index, so blocks are flushed at the same size whatever else runs on the machine
+        self.memory_budget = int(self.memory_threshold * psutil.virtual_memory().total / self.workers)
         self.positional = args.indexer.storing.store_term_position
-        print("Positional: ",self.positional)
-        self._inverted_index = InvertedIndex(self.index_output_folder, self.positional)
-        self.reader = Reader(args.path_to_collection)
+        self.format = args.indexer.storing.format
+        self.bm25 = args.indexer.storing.bm25
+        self.tfidf = args.indexer.storing.tfidf
         self.tokenizer = tokenizer
         self.total_docs_lenght = 0
+        # length and lnc norm of every document, indexed by doc id, written once to docs_len.bin / docs_norm.bin
+        self.docs_len = array("I")
+        self.docs_norm = array("f")
         self.doc_mapping = {}
+        self.blocks_written = 0
+        # number of the segment being written (0 is the base index) and first doc id it holds
+        self.segment = 0
+        self.first_doc_id = 0
+        if appending:
+            self.load_existing_index()
+        print("Positional: ",self.positional)
+        print("Format: ",self.format)
+        self._inverted_index = InvertedIndex(self.index_output_folder, self.positional, self.format,
+                                             posting_threshold=self.posting_threshold, memory_budget=self.memory_budget)
+        self.reader = Reader(args.path_to_collection)
+
+    def load_existing_index(self):
+        """
+        Loads the state of the index in the output folder, so the new documents continue its doc ids
+        and are written as its next segment. The format, positions and tokenizer of the existing index
+        are kept, whatever the arguments say, so every segment can be searched the same way.
+        """
+        folder = self.index_output_folder
+        with open(os.path.join(folder, "docs_info.txt"), "r") as f:
+            info = dict(line.split(':', 1) for line in f.read().splitlines())
+
+        self.segment = int(info.get("segments", 1))
+        print(f"Appending to an index with format {info['format']} and positional {info['positional']}")
+        self.format = info["format"]
+        self.positional = info["positional"] == "True"
+
+        tokenizer_config = {key[len("tokenizer."):]: value for key, value in info.items() if key.startswith("tokenizer.")}
+        if tokenizer_config:
+            if tokenizer_config["stopwords_path"] != "None":
+                tokenizer_config["stopwords_path"] = os.path.join(folder, tokenizer_config["stopwords_path"])
+            self.tokenizer = Tokenizer.from_config(tokenizer_config, self.positional)
+
+        pmids = array("Q")
+        with open(os.path.join(folder, "doc_mapping.bin"), "rb") as f:
+            pmids.frombytes(f.read())
+        self.doc_mapping = {pmid: doc_id for doc_id, pmid in enumerate(pmids)}
+        with open(os.path.join(folder, "docs_len.bin"), "rb") as f:
+            self.docs_len.frombytes(f.read())
+        with open(os.path.join(folder, "docs_norm.bin"), "rb") as f:
+            self.docs_norm.frombytes(f.read())
+        self.total_docs_lenght = sum(self.docs_len)
+        self.first_doc_id = len(self.doc_mapping)
+
+        # the cached weights depend on the statistics of the whole collection, which change
+        for name in ["bm25_cache.bin", "tfidf_cache.bin"]:
+            if os.path.exists(os.path.join(folder, name)):
+                os.remove(os.path.join(folder, name))
+        print(f"Appending segment {self.segment} to an index of {self.first_doc_id} documents")
+
+    def document_batches(self):
+        """
+        Yields batches of (doc_id, content) with the documents that were not indexed yet,
+        giving them doc ids in the order they are read.
+        """
+        for batch in self.reader.read_batches(DOCS_PER_TASK):
+            documents = []
+            for pmid, content in batch:
+                if pmid in self.doc_mapping:
+                    continue
+                doc_id = len(self.doc_mapping)
+                self.doc_mapping[pmid] = doc_id
+                documents.append((doc_id, content))
+            if documents:
+                yield documents
+
+    def index_serial(self):
+        for batch in self.document_batches():
+            for doc_id, content in batch:
+                doc_lenght, doc_norm = invert_document(self.tokenizer, self._inverted_index, doc_id, content)
+                self.total_docs_lenght += doc_lenght
+                self.docs_len.append(doc_lenght)
+                self.docs_norm.append(doc_norm)
+
+                if self._inverted_index.is_full():
+                    self._inverted_index.write_in_disk(self.index_output_folder)
+                    self._inverted_index.clean_posting_list()
+                    print(f"\nBlock {self._inverted_index.block_counter} finished")
+
+        if self._inverted_index.posting_list:
+            self._inverted_index.write_in_disk(self.index_output_folder)
+            self._inverted_index.clean_posting_list()
+            print(f"\nBlock {self._inverted_index.block_counter} finished")
+        self.blocks_written = self._inverted_index.block_counter
+
+    def index_parallel(self):
+        # the documents are read and given a doc id here, so the ids are the same as in a serial run,
+        # and sent in batches to the workers. Each worker gets batches in increasing doc id order,
+        # so its blocks are sorted by doc id like the serial ones, and the merge combines all of them.
+        context = multiprocessing.get_context("fork")
+        tasks = context.Queue(maxsize=2 * self.workers)
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=index_worker,
+                args=(worker_id, self.tokenizer, self.index_output_folder, self.positional, self.format,
+                      self.posting_threshold, self.memory_budget, tasks, results),
+            )
+            for worker_id in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            for batch in self.document_batches():
+                self.send_task(tasks, batch, processes)
+            for _ in processes:
+                self.send_task(tasks, None, processes)
+
+            # the documents of an existing index (when appending) keep their values
+            new_docs = len(self.doc_mapping) - len(self.docs_len)
+            self.docs_len.frombytes(bytes(self.docs_len.itemsize * new_docs))
+            self.docs_norm.frombytes(bytes(self.docs_norm.itemsize * new_docs))
+            for _ in processes:
+                doc_ids, docs_len, docs_norm, blocks = self.wait_worker_result(results, processes)
+                for doc_id, doc_lenght, doc_norm in zip(doc_ids, docs_len, docs_norm):
+                    self.docs_len[doc_id] = doc_lenght
+                    self.docs_norm[doc_id] = doc_norm
+                self.total_docs_lenght += sum(docs_len)
+                self.blocks_written += blocks
+        except BaseException:
+            # a reader error (or a failed worker) would leave the workers waiting for batches forever,
+            # and the batches still queued would keep the process from exiting
+            tasks.cancel_join_thread()
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+            raise
+
+        for process in processes:
+            process.join()
+        print(f"\n{self.blocks_written} blocks finished by {self.workers} workers")
+
+    def check_workers(self, processes):
+        if any(process.exitcode not in (None, 0) for process in processes):
+            raise RuntimeError("An indexing worker failed, see the traceback above")
+
+    def send_task(self, tasks, task, processes):
+        # the queue is bounded, so a failed worker is noticed while waiting for room in it
+        while 1:
+            try:
+                return tasks.put(task, timeout=1)
+            except queue.Full:
+                self.check_workers(processes)
+
+    def wait_worker_result(self, results, processes):
+        while 1:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                self.check_workers(processes)
 
     def index(self):
         print("Indexing documents...")
         
         tic = time.time()
-        while 1:
-            pmid, content = self.reader.read()
-            if pmid == None:
-                break
-
-            if pmid in self.doc_mapping:
-                continue
-
-            doc_id = len(self.doc_mapping)
-            self.doc_mapping[pmid] = doc_id
-            
-            terms = self.tokenizer.tokenize(content)
-            
-            
-            doc_lenght = len(terms)
-            self.total_docs_lenght += doc_lenght
-            with open(os.path.join(self.index_output_folder, "docs_len.txt"), "a") as f:
-                f.write(f"{doc_id}:{doc_lenght}\n")
-
-            tokens = {}
-            for i, token in enumerate(terms):
-                tokens.setdefault(token, {}).setdefault(doc_id, []).append(i)
-            _ = [
-                self._inverted_index.add_term(
-                    token,
-                    doc_id,
-                    positions,
-                )
-                for token, data in tokens.items()
-                for doc_id, positions in data.items()
-            ]
-            
-            if self.memory_threshold != None and psutil.virtual_memory().percent/100 > self.memory_threshold:
-                print(psutil.virtual_memory().percent)
-                self._inverted_index.write_in_disk(self.index_output_folder)
-                self._inverted_index.clean_posting_list()
-                print(f"\nBlock {self._inverted_index.block_counter} finished")
-
-        self._inverted_index.write_in_disk(self.index_output_folder)
-        self._inverted_index.clean_posting_list()
-        print(f"\nBlock {self._inverted_index.block_counter} finished")
+        if self.workers > 1:
+            self.index_parallel()
+        else:
+            self.index_serial()
         toc = time.time()
 
+        tic_docs = time.time()
+        # when appending only the values of the new documents are added at the end of the files
+        mode = "ab" if self.segment else "wb"
+        with open(os.path.join(self.index_output_folder, "docs_len.bin"), mode) as f:
+            self.docs_len[self.first_doc_id:].tofile(f)
+        with open(os.path.join(self.index_output_folder, "docs_norm.bin"), mode) as f:
+            self.docs_norm[self.first_doc_id:].tofile(f)
+
+        total_docs = len(self.doc_mapping)
+        avgdl = int(self.total_docs_lenght / total_docs)
+        # the weights can only be cached when the whole index is built at once
+        cache_weights = self.segment == 0
+        if not cache_weights and (self.bm25.cache_in_disk or self.tfidf.cache_in_disk):
+            print("The bm25 / tf-idf weights are not cached when appending, index the whole collection again to cache them")
         with open(os.path.join(self.index_output_folder, "docs_info.txt"), "w") as f:
-            total_docs = len(self.doc_mapping)
             f.write(f"total_docs:{total_docs}\n")
-            f.write(f"avgdl:{int(self.total_docs_lenght / total_docs)}\n")
-
-        with open(os.path.join(self.index_output_folder, "doc_mapping.txt"), "w") as f:
-            for doc_id, pmid in enumerate(self.doc_mapping):
-                f.write(f"{pmid}:{doc_id}\n")
+            f.write(f"avgdl:{avgdl}\n")
+            f.write(f"format:{self.format}\n")
+            f.write(f"positional:{self.positional}\n")
+            f.write(f"segments:{self.segment + 1}\n")
+            # the searcher only uses the cached weights when it ranks with the same parameters
+            if cache_weights and self.bm25.cache_in_disk:
+                f.write(f"bm25.k1:{self.bm25.k1}\n")
+                f.write(f"bm25.b:{self.bm25.b}\n")
+            if cache_weights and self.tfidf.cache_in_disk:
+                f.write(f"tfidf.smart:{self.tfidf.smart}\n")
+            # the searcher rebuilds the same tokenizer, so queries give the terms that were indexed
+            tokenizer_config = self.tokenizer.config()
+            if tokenizer_config["stopwords_path"] is not None:
+                stopwords_copy = os.path.join(self.index_output_folder, "stopwords.txt")
+                if os.path.abspath(tokenizer_config["stopwords_path"]) != os.path.abspath(stopwords_copy):
+                    shutil.copyfile(tokenizer_config["stopwords_path"], stopwords_copy)
+                tokenizer_config["stopwords_path"] = "stopwords.txt"
+            for key, value in tokenizer_config.items():
+                f.write(f"tokenizer.{key}:{value}\n")
+
+        # pmid of every document, indexed by doc id (the mapping keeps the order the doc ids were given)
+        with open(os.path.join(self.index_output_folder, "doc_mapping.bin"), mode) as f:
+            array("Q", itertools.islice(self.doc_mapping, self.first_doc_id, None)).tofile(f)
             self.doc_mapping = []
+        toc_docs = time.time()
+
+        impacts = []
+        if cache_weights and self.bm25.cache_in_disk:
+            impacts.append(BM25Impacts(self.index_output_folder, self.bm25.k1, self.bm25.b, self.docs_len, total_docs, avgdl))
+        if cache_weights and self.tfidf.cache_in_disk:
+            impacts.append(TFIDFImpacts(self.index_output_folder, self.tfidf.smart, self.docs_len, self.docs_norm))
 
         tic_merge = time.time()
-        self._inverted_index.merge_blocks(self.index_output_folder, self.memory_threshold)
+        self._inverted_index.merge_blocks(self.index_output_folder, impacts, self.docs_len, self.segment)
         toc_merge = time.time()
 
             # write to file Index Statistics for the file
@@ -89,22 +275,82 @@ class SPIMIIndexer:
         with open(file, "w") as f:
             f.write("INDEX STATISTICS\n")
             f.write("\n")
-            f.write("Total index size on disk : {0} MB\n".format(round(os.stat(os.path.join(self.index_output_folder, 'index.txt')).st_size / 1024 / 1024, 2)))
+            f.write("Segment : {0} ({1} documents added)\n".format(self.segment, len(self.docs_len) - self.first_doc_id))
+            f.write("Total index size on disk : {0} MB\n".format(round(os.stat(os.path.join(self.index_output_folder, index_filename(self.format, self.segment))).st_size / 1024 / 1024, 2)))
             f.write("Total Indexing time : {0} s\n".format(toc-tic))
-            f.write("Number of temporary index segments written to disk (before merging) : {0}\n".format(len(self.doc_mapping)))
+            f.write("Document metadata size on disk (lengths, norms and pmid mapping) : {0} MB\n".format(round(sum(os.stat(os.path.join(self.index_output_folder, name)).st_size for name in ["docs_len.bin", "docs_norm.bin", "doc_mapping.bin"]) / 1024 / 1024, 2)))
+            f.write("Document metadata writing time : {0} s\n".format(toc_docs - tic_docs))
+            f.write("Number of temporary index segments written to disk (before merging) : {0}\n".format(self.blocks_written))
             f.write("Merging time (last SPIMI step) : {0} s\n".format(toc_merge - tic_merge))
             f.write("Total time : {0} s\n".format(toc_merge - tic)) 
         
+def invert_document(tokenizer, inverted_index, doc_id, content):
+    """
+    Tokenizes a document and adds its terms to the inverted index, returning the
+    document length and the norm of its lnc vector (cosine of the 1 + log(tf) weights).
+    """
+    terms = tokenizer.tokenize(content)
+
+    tokens = {}
+    for i, token in enumerate(terms):
+        tokens.setdefault(token, []).append(i)
+    squared_norm = 0
+    for token, positions in tokens.items():
+        inverted_index.add_term(token, doc_id, positions)
+        squared_norm += (1 + math.log(len(positions))) ** 2
+
+    return len(terms), math.sqrt(squared_norm)
+
+
+def index_worker(worker_id, tokenizer, folder, positional, format, posting_threshold, memory_budget, tasks, results):
+    """Builds and flushes the SPIMI blocks of the batches of documents received through the tasks queue."""
+    inverted_index = InvertedIndex(folder, positional, format, block_name=f"block_{worker_id}",
+                                   posting_threshold=posting_threshold, memory_budget=memory_budget)
+    doc_ids = array("I")
+    docs_len = array("I")
+    docs_norm = array("f")
+    while 1:
+        batch = tasks.get()
+        if batch is None:
+            break
+        for doc_id, content in batch:
+            doc_lenght, doc_norm = invert_document(tokenizer, inverted_index, doc_id, content)
+            doc_ids.append(doc_id)
+            docs_len.append(doc_lenght)
+            docs_norm.append(doc_norm)
+
+            if inverted_index.is_full():
+                inverted_index.write_in_disk(folder)
+                inverted_index.clean_posting_list()
+
+    if inverted_index.posting_list:
+        inverted_index.write_in_disk(folder)
+        inverted_index.clean_posting_list()
+    results.put((doc_ids, docs_len, docs_norm, inverted_index.block_counter))
+
 class InvertedIndex:
-    def __init__(self, index_output_folder, positional):
+    def __init__(self, index_output_folder, positional, format="text", block_name="block",
+                 posting_threshold=None, memory_budget=None):
         self.index_output_folder = index_output_folder
         self.positional = positional
+        self.format = format
+        self.block_name = block_name
+        self.posting_threshold = posting_threshold
+        self.memory_budget = memory_budget
         self.posting_list = {}
         self.block_counter = 0
-        self.temp_index = {}
+        # updated in add_term, so checking if the block is full costs nothing
+        self.postings_count = 0
+        self.estimated_size = 0
 
     def add_term(self, term, doc_id, positions):
+        self.postings_count += 1
+        self.estimated_size += POSTING_SIZE
+        if term not in self.posting_list:
+            self.estimated_size += TERM_SIZE
         if self.positional:
+            self.estimated_size += POSITIONS_SIZE + POSITION_SIZE * len(positions)
+
             if term not in self.posting_list:
                 self.posting_list[term] = {doc_id: positions}
             else:
@@ -117,13 +363,21 @@ class InvertedIndex:
 
     def clean_posting_list(self):
         self.posting_list = {}
+        self.postings_count = 0
+        self.estimated_size = 0
+
+    def is_full(self):
+        """Signals if the block reached the posting threshold or the memory budget and should be written to disk."""
+        if self.posting_threshold != None and self.postings_count >= self.posting_threshold:
+            return True
+        return self.memory_budget != None and self.estimated_size >= self.memory_budget
 
     def write_in_disk(self, folder):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
         sorted_index = {k: self.posting_list[k] for k in sorted(self.posting_list)}
-        filename = f"{folder}/block_{self.block_counter}.txt"
+        filename = f"{folder}/{self.block_name}_{self.block_counter}.txt"
         with open(filename, "wb") as f:
             if self.positional:
                 for term, posting in sorted_index.items():
@@ -136,108 +390,141 @@ class InvertedIndex:
 
         self.block_counter += 1
 
-    def dump_to_disk(self, folder):
-        print("Dumping index{self.index_counter}")
-        with open(f"{folder}/index{self.index_counter}.txt", "w") as f:
-            for term in self.temp_index:
-                f.write(f"{term};{self.temp_index[term]}\n")
-        # with open(f"{folder}/index_list.txt{self.index_counter}", "w") as f:
-        #     for term in temp_index:
-        #         f.write(f"{current_term};{temp_index[term]}\n")
-        print(f"Index{self.index_counter}.txt finished")
-
-        self.temp_index = {}
-        self.index_counter += 1
+    def push_next_line(self, heap, files, block_id):
+        line = files[block_id].readline().decode("utf-8").rstrip("\n")
+        if line == "":
+            files.pop(block_id).close()
+            return
+        term, postings = line.split(';', 1)
+        heapq.heappush(heap, (term, block_id, postings))
 
-    def merge_blocks(self, folder, memory_threshold):
+    def merge_blocks(self, folder, impacts=(), docs_len=None, segment=0):
         print("Merging blocks...")
 
-        files_ended = 0
-        
         files = {}
         for block_id, path in enumerate(os.scandir(self.index_output_folder)):
             if path.is_file() and path.name.startswith("block_"):
-                files[block_id] = open(path, "rb")
+                files[block_id] = open(path, "rb", buffering=READ_BUFFER_SIZE)
+
+        # k-way merge: the heap always holds the next line of every block that was not exhausted yet,
+        # ordered by term, so all the blocks that contain the smallest term are popped together.
+        # Terms come out sorted, so they are written straight to the final index and lexicon
+        # and only the postings of the current term are kept in memory.
+        heap = []
+        for block_id in list(files):
+            self.push_next_line(heap, files, block_id)
+
+        # an append (segment > 0) writes a delta segment next to the existing index
+        lexicon = LexiconWriter(f"{folder}/{lexicon_filename(segment)}")
+        offset = 0
+        postings_written = 0
+
+        with open(f"{folder}/{index_filename(self.format, segment)}", "wb", buffering=WRITE_BUFFER_SIZE) as index_file:
+            while heap:
+                current_term = heap[0][0]
+
+                segments = []
+                while heap and heap[0][0] == current_term:
+                    _, block_id, current_postings = heapq.heappop(heap)
+                    segments.append(parse_text_postings(current_postings))
+                    self.push_next_line(heap, files, block_id)
+
+                # the same term may come from several blocks, their postings are combined in doc id order
+                if len(segments) == 1:
+                    postings = segments[0]
+                else:
+                    postings = list(heapq.merge(*segments, key=lambda posting: posting[0]))
+
+                freq = sum(posting[2] for posting in postings)
+                encoded = encode_postings(current_term, postings, self.positional, self.format, docs_len)
+                index_file.write(encoded)
+
+                max_impact = 0
+                for cache in impacts:
+                    weights = cache.add(postings)
+                    if isinstance(cache, BM25Impacts):
+                        max_impact = max(weights)
+
+                # upper bounds of the term score, used by the searcher to skip documents (MaxScore)
+                max_tf = max(posting[2] for posting in postings)
+                min_doc_len = min(docs_len[posting[0]] for posting in postings) if docs_len else 0
+
+                # df, cf, offset and length of every term, so the searcher can seek straight to the postings
+                lexicon.add(current_term, len(postings), freq, offset, len(encoded), postings_written,
+                            max_tf, min_doc_len, max_impact)
+                offset += len(encoded)
+                postings_written += len(postings)
+
+        lexicon.close()
+        for cache in impacts:
+            cache.close()
 
-        lines = {}
-        for block_id, file in files.items():
-            lines[block_id] = file.readline().decode("utf-8").strip()
-        
-        # index_start_term = None
+        print("Deleting temporary files...")
+        _ = [
+                os.remove(filename) 
+                for filename in os.scandir(self.index_output_folder) 
+                if filename.is_file() and filename.name.startswith("block_")
+            ]
 
-        saved_term = None
-        saved_postings = None
-        current_term = None
-        current_postings = None
+        print("Merge complete...")
 
-        self.index_counter = 0
 
-        while files_ended < len(files):
+class ImpactsCache:
+    """
+    Precomputed weight of every posting of the index, stored as float32 in
+    the same order as the postings are merged, so the weights of a term
+    start at its first_posting in the lexicon. Subclasses set the filename
+    and define weights(postings), the weights of the postings of one term.
+    """
 
-            min_index = min(lines, key=lambda x: list(lines[x])[0])
-            line = lines[min_index]
+    filename = None
 
-            current_term, current_postings = line.split(';', 1)
+    def __init__(self, folder):
+        self.file = open(os.path.join(folder, self.filename), "wb", buffering=WRITE_BUFFER_SIZE)
 
-            # Se for um termo novo
-            if current_term != saved_term:
+    def add(self, postings):
+        weights = array("f", self.weights(postings))
+        weights.tofile(self.file)
+        return weights
 
-                freq = 0
-                for posting in current_postings.split(";"):
-                    if ':' in posting:
-                        _, positions = posting.split(':')
-                        positions = list(map(int, positions.split(',')))
-                        freq += len(positions)
-                    else:
-                        freq += int(posting.split(',')[1])
+    def close(self):
+        self.file.close()
 
-                with open(f"{folder}/term_frequencies.txt", "a") as f:
-                    f.write(f"{current_term}:{freq}\n")
 
-                self.temp_index[current_term] = current_postings
+class BM25Impacts(ImpactsCache):
+    filename = "bm25_cache.bin"
 
-                if memory_threshold != None and psutil.virtual_memory().percent / 100 > memory_threshold:
-                    print("Memory exceeded the threshold: ",psutil.virtual_memory().percent)
-                    self.dump_to_disk(folder)
+    def __init__(self, folder, k1, b, docs_len, total_docs, avgdl):
+        super().__init__(folder)
+        self.k1 = k1
+        self.b = b
+        self.docs_len = docs_len
+        self.total_docs = total_docs
+        self.avgdl = avgdl
 
-                saved_term = current_term
+    def weights(self, postings):
+        k1, b = self.k1, self.b
+        df = len(postings)
+        idf = math.log((self.total_docs - df + 0.5) / (df + 0.5) + 1)
+        return [
+            idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (self.docs_len[doc_id] / self.avgdl))))
+            for doc_id, _, tf in postings
+        ]
 
-            elif current_term:
-                current_postings += f";{current_postings}"
 
-            lines[min_index] = files[min_index].readline().decode('utf-8')[:-1]
-            if lines[min_index] == None or lines[min_index] == "":
-                files[min_index].close()
-                files.pop(min_index)
-                lines.pop(min_index)
-                files_ended += 1
+class TFIDFImpacts(ImpactsCache):
+    filename = "tfidf_cache.bin"
 
-        self.dump_to_disk(folder)
-        
-        print("Deleting temporary files...")
-        _ = [
-                os.remove(filename) 
-                for filename in os.scandir(self.index_output_folder) 
-                if filename.is_file() and filename.name.startswith("block_")
-            ]
-        
-        ########## Merging the merged_indexes ##########
-        
-        index_files = [
-            filename 
-            for filename in os.scandir(self.index_output_folder) 
-            if filename.is_file() and filename.name.startswith("index")
-        ]
-        
-        if len(index_files) == 1:
-            os.rename(f'{folder}/index0.txt', f'{folder}/index.txt')
-        elif len(index_files) > 1:
-            # Merge files
-            with open(f'{folder}/index.txt', 'w') as outfile:
-                for input_file in index_files:
-                    with open(input_file, 'r') as infile:
-                        outfile.write(infile.read())
-                    os.remove(input_file)
-
-        print("Merge complete...")
+    def __init__(self, folder, smart, docs_len, docs_norm):
+        # only the document side of the weighting is known at indexing time, same as in Searcher.tf_idf_search
+        if smart not in CACHED_SMART_NOTATIONS:
+            raise ValueError(f"SMART notation {smart} can not be cached, use {' or '.join(CACHED_SMART_NOTATIONS)}")
+        super().__init__(folder)
+        self.smart = smart
+        self.docs_len = docs_len
+        self.docs_norm = docs_norm
 
+    def weights(self, postings):
+        if self.smart == "lnc.ltc":
+            return [(1 + math.log(tf)) / self.docs_norm[doc_id] for doc_id, _, tf in postings]
+        return [1 / math.sqrt(self.docs_len[doc_id]) for doc_id, _, _ in postings]
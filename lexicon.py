@@ -0,0 +1,205 @@
+import struct
+from array import array
+from bisect import bisect_right
+from zlib import crc32
+
+
+def lexicon_filename(segment=0):
+    """Lexicon of the base index (segment 0) or of the delta segment added by the segment-th append."""
+    return "lexicon.bin" if segment == 0 else f"lexicon_{segment}.bin"
+
+
+class Lexicon:
+    """
+    Compact on-disk term dictionary.
+
+    The terms are stored sorted in a single utf-8 string table and every
+    statistic lives in a typed array indexed by term id, so loading millions
+    of terms does not create millions of python objects. Lookups go through
+    an open addressing hash table (crc32 + linear probing) stored next to
+    the arrays, so df/cf are O(1) to find.
+    """
+
+    MAGIC = b"LEX1"
+    HEADER = struct.Struct("<4sQQQQ")  # magic, number of columns, number of terms, number of slots, size of the string table
+
+    # name and array typecode of each per-term column, in file order
+    COLUMNS = [
+        ("df", "I"),       # number of documents that contain the term
+        ("cf", "Q"),       # number of occurrences of the term in the collection
+        ("offset", "Q"),   # byte offset of the postings inside the index file
+        ("length", "Q"),   # byte length of the postings inside the index file
+        ("first_posting", "Q"),  # number of postings stored before the ones of the term, position of its cached weights
+        ("max_tf", "I"),   # highest frequency of the term in a document
+        ("min_doc_len", "I"),  # length of the shortest document that contains the term
+        ("max_impact", "f"),   # highest cached bm25 weight of the term (0 without the bm25 cache)
+    ]
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        magic, n_columns, n_terms, n_slots, strings_size = self.HEADER.unpack_from(data, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a lexicon file")
+        if n_columns != len(self.COLUMNS):
+            raise ValueError(f"{path} was written by another version of the indexer, the collection must be indexed again")
+        pos = self.HEADER.size
+
+        self.term_starts, pos = self._read_array(data, pos, "Q", n_terms + 1)
+        for name, typecode in self.COLUMNS:
+            column, pos = self._read_array(data, pos, typecode, n_terms)
+            setattr(self, name, column)
+        self.slots, pos = self._read_array(data, pos, "i", n_slots)
+        self.strings = data[pos:pos + strings_size]
+
+        self.n_terms = n_terms
+        self.mask = n_slots - 1
+
+    @staticmethod
+    def _read_array(data, pos, typecode, size):
+        values = array(typecode)
+        end = pos + size * values.itemsize
+        values.frombytes(data[pos:end])
+        return values, end
+
+    def __len__(self):
+        return self.n_terms
+
+    def __contains__(self, term):
+        return self.lookup(term) != -1
+
+    def term(self, term_id) -> str:
+        return self.strings[self.term_starts[term_id]:self.term_starts[term_id + 1]].decode("utf-8")
+
+    def lookup(self, term) -> int:
+        """Returns the term id of the term, or -1 if it is not in the lexicon."""
+        key = term.encode("utf-8")
+        slot = crc32(key) & self.mask
+        while True:
+            term_id = self.slots[slot]
+            if term_id == -1:
+                return -1
+            if self.strings[self.term_starts[term_id]:self.term_starts[term_id + 1]] == key:
+                return term_id
+            slot = (slot + 1) & self.mask
+
+    def memory_usage(self) -> int:
+        """Size in bytes of the arrays and string table held in memory."""
+        arrays = [self.term_starts, self.slots] + [getattr(self, name) for name, _ in self.COLUMNS]
+        return len(self.strings) + sum(a.itemsize * len(a) for a in arrays)
+
+    def locations(self, term_id) -> list:
+        """(segment, term id inside the segment lexicon) of every segment that holds the term."""
+        return [(0, term_id)]
+
+
+class SegmentedLexicon:
+    """
+    Lexicon of an index made of a base segment and the delta segments written by
+    appends (--indexer.append), with the lookup interface of Lexicon.
+
+    A term gets the id of its first segment, shifted by the number of terms of the
+    segments before it. The statistics of the term are combined over every segment
+    that holds it (df and cf are added, max_tf and min_doc_len are the extremes);
+    the per segment columns (offset, length, ...) are read from each Lexicon
+    through locations.
+    """
+
+    def __init__(self, lexicons):
+        self.lexicons = lexicons
+        self.starts = []
+        total = 0
+        for lexicon in lexicons:
+            self.starts.append(total)
+            total += len(lexicon)
+        self.df = _CombinedColumn(self, "df", sum)
+        self.cf = _CombinedColumn(self, "cf", sum)
+        self.max_tf = _CombinedColumn(self, "max_tf", max)
+        self.min_doc_len = _CombinedColumn(self, "min_doc_len", min)
+
+    def __contains__(self, term):
+        return self.lookup(term) != -1
+
+    def split(self, term_id):
+        segment = bisect_right(self.starts, term_id) - 1
+        return segment, term_id - self.starts[segment]
+
+    def term(self, term_id) -> str:
+        segment, local_id = self.split(term_id)
+        return self.lexicons[segment].term(local_id)
+
+    def lookup(self, term) -> int:
+        for start, lexicon in zip(self.starts, self.lexicons):
+            term_id = lexicon.lookup(term)
+            if term_id != -1:
+                return start + term_id
+        return -1
+
+    def locations(self, term_id) -> list:
+        segment, local_id = self.split(term_id)
+        term = self.lexicons[segment].term(local_id)
+        locations = [(segment, local_id)]
+        for other in range(segment + 1, len(self.lexicons)):
+            other_id = self.lexicons[other].lookup(term)
+            if other_id != -1:
+                locations.append((other, other_id))
+        return locations
+
+    def memory_usage(self) -> int:
+        return sum(lexicon.memory_usage() for lexicon in self.lexicons)
+
+
+class _CombinedColumn:
+    """Read-only column of a SegmentedLexicon, combining the values of every segment that holds the term."""
+
+    def __init__(self, lexicon, name, combine):
+        self.lexicon = lexicon
+        self.name = name
+        self.combine = combine
+
+    def __getitem__(self, term_id):
+        lexicons = self.lexicon.lexicons
+        return self.combine(getattr(lexicons[segment], self.name)[local_id] for segment, local_id in self.lexicon.locations(term_id))
+
+
+class LexiconWriter:
+    """
+    Builds a lexicon one term at a time, so it can be produced while the
+    index is being merged. Terms must be added in sorted order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.term_starts = array("Q", [0])
+        self.columns = [array(typecode) for _, typecode in Lexicon.COLUMNS]
+        self.strings = bytearray()
+
+    def add(self, term, *values):
+        self.strings += term.encode("utf-8")
+        self.term_starts.append(len(self.strings))
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def close(self):
+        term_starts, strings = self.term_starts, self.strings
+        n_terms = len(term_starts) - 1
+        n_slots = 1
+        while n_slots < 2 * n_terms:
+            n_slots *= 2
+        mask = n_slots - 1
+
+        slots = array("i", [-1]) * n_slots
+        for term_id in range(n_terms):
+            slot = crc32(strings[term_starts[term_id]:term_starts[term_id + 1]]) & mask
+            while slots[slot] != -1:
+                slot = (slot + 1) & mask
+            slots[slot] = term_id
+
+        with open(self.path, "wb") as f:
+            f.write(Lexicon.HEADER.pack(Lexicon.MAGIC, len(self.columns), n_terms, n_slots, len(strings)))
+            term_starts.tofile(f)
+            for column in self.columns:
+                column.tofile(f)
+            slots.tofile(f)
+            f.write(strings)
@@ -14,11 +14,19 @@ was performed, yet].
 
 import argparse
 from cliutils import grouping_args, shared_tokenizer, cli_debug_printer
-from indexer import SPIMIIndexer
+from indexer import SPIMIIndexer, CACHED_SMART_NOTATIONS
 from tokenizer import Tokenizer
+from codec import FORMATS
 import time
 
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="CLI interface for the IR engine")
@@ -37,7 +45,7 @@ if __name__ == "__main__":
     
     indexer_parser.add_argument('path_to_collection', 
                                 type=str, 
-                                help='Name of the folder or file that holds the document collection to be indexed.')
+                                help='Name of the folder or file that holds the document collection to be indexed (it can be compressed with gzip, bzip2, xz or zstandard).')
     
     indexer_parser.add_argument('index_output_folder', 
                                 type=str, 
@@ -50,20 +58,35 @@ if __name__ == "__main__":
                                     default="SPIMI",
                                     help='Maximum limit of RAM that the program (index) should consume. (Default: SPIMI)')
     
-    #indexer_settings_parser.add_argument('--indexer.posting_threshold', 
-    #                                type=float, 
-    #                                default=None,
-    #                                help='Maximum number of postings that each index should hold. (Default: None)')
+    indexer_settings_parser.add_argument('--indexer.posting_threshold', 
+                                    type=int, 
+                                    default=None,
+                                    help='Maximum number of postings that each index block should hold before being written to disk. (Default: None)')
     
     indexer_settings_parser.add_argument('--indexer.memory_threshold', 
                                     type=float, 
                                     default=None,
-                                    help='Maximum limit of RAM that the program (index) should consume. (Default: None)')
+                                    help='Maximum limit of RAM that the program (index) should consume, as a fraction of the total memory of the machine. It is turned into an estimated byte budget for the postings held by each index block. (Default: 0.8)')
+
+    indexer_settings_parser.add_argument('--indexer.workers',
+                                    type=positive_int,
+                                    default=1,
+                                    help='Number of processes that tokenize the documents and build the SPIMI blocks in parallel. (Default: 1)')
+
+    indexer_settings_parser.add_argument('--indexer.append',
+                                    action="store_true",
+                                    help='Adds the documents of the collection to the index already in index_output_folder, as a new segment, instead of building it again. Documents already indexed are skipped; the format, positions and tokenizer of the existing index are kept. (Default is False)')
 
     indexer_settings_parser.add_argument('--indexer.storing.store_term_position',
                                          action="store_true",
                                          help='Signals if the indexer should store the term positions along side the term frequencies. (Default is False)')
     
+    indexer_settings_parser.add_argument('--indexer.storing.format',
+                                         type=str,
+                                         default="text",
+                                         choices=FORMATS,
+                                         help='Format of the postings stored in the final index: plain text, or binary with doc id and position gaps compressed with variable-byte or Elias-gamma codes. (Default is text)')
+    
     indexer_settings_parser.add_argument('--indexer.storing.bm25.cache_in_disk', 
                                     action="store_true",
                                     help='Signals if the index should create a cache file to store all intermediate computations of the BM25 ranking method. (Default is False)')
@@ -83,6 +106,7 @@ if __name__ == "__main__":
     indexer_settings_parser.add_argument('--indexer.storing.tfidf.smart',
                                     type=str,
                                     default="lnc.ltc",
+                                    choices=CACHED_SMART_NOTATIONS,
                                     help='The smart notation of the tfidf, this value will only be used if the flag --indexer.tfidf.cache_in_disk is set to True. (Default=lnc.ltc)')
     
         
@@ -105,7 +129,7 @@ if __name__ == "__main__":
                                     #dest="stemmer",
                                     type=str, 
                                     default=None,
-                                    help='Type of stemmer to be used. The absence means that will not be used (default=None).')
+                                    help='Type of stemmer to be used, pystemmer (english snowball stemmer) is supported. The absence means that will not be used (default=None).')
     
     indexer_doc_parser.add_argument('--tokenizer.regular_exp',
                                     #dest="stemmer",
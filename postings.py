@@ -0,0 +1,229 @@
+from bisect import bisect_left
+
+from codec import BLOCK_SIZE, read_skips, decode_block
+
+# doc id of a cursor that went past its last posting
+END = float("inf")
+
+# rough memory used by a decoded (doc_id, positions, freq) posting and by each of its positions
+POSTING_SIZE = 150
+POSITION_SIZE = 36
+
+
+def postings_size(postings):
+    """Estimate of the bytes held by a decoded postings list."""
+    return sum(POSTING_SIZE + POSITION_SIZE * len(positions) for _, positions, _ in postings)
+
+
+class PostingsCursor:
+    """
+    Document-at-a-time iterator over the postings of one query term, already decoded.
+    Used for the text format, which has no skip entries.
+
+    Parameters
+    ----------
+    postings : list
+        (doc_id, positions, freq) postings of the term, sorted by doc id
+    weight : callable
+        weight(i, doc_id, freq) gives the score contribution of the i-th posting
+    upper_bound : float
+        an upper bound of every weight of the term
+    """
+
+    def __init__(self, postings, weight, upper_bound):
+        self.postings = postings
+        self.doc_ids = [doc_id for doc_id, _, _ in postings]
+        self.weight = weight
+        self.upper_bound = upper_bound
+        self.pos = 0
+        self.doc = self.doc_ids[0] if self.doc_ids else END
+        self.last_doc = self.doc_ids[-1] if self.doc_ids else -1
+        # number of postings whose weight was computed
+        self.evaluated = 0
+        # number of postings the cursor had to decode, none as they were decoded (and counted) by the searcher
+        self.decoded = 0
+        # position of the term in the query
+        self.order = 0
+
+    def next(self):
+        self.pos += 1
+        self.doc = self.doc_ids[self.pos] if self.pos < len(self.doc_ids) else END
+
+    def next_geq(self, doc_id):
+        """Moves to the first posting with a doc id greater or equal to doc_id."""
+        if self.doc >= doc_id:
+            return
+        self.pos = bisect_left(self.doc_ids, doc_id, self.pos)
+        self.doc = self.doc_ids[self.pos] if self.pos < len(self.doc_ids) else END
+
+    def block_upper_bound(self, doc_id):
+        """Upper bound of the weight of the posting of doc_id, if the term has one."""
+        return self.upper_bound
+
+    def positions(self):
+        return self.postings[self.pos][1]
+
+    def score(self):
+        self.evaluated += 1
+        return self.weight(self.pos, self.doc, self.postings[self.pos][2])
+
+
+class BlockPostingsCursor:
+    """
+    Document-at-a-time iterator over the binary postings of one query term. Only the
+    skip entries are read up front; a block is decoded when the cursor stops inside
+    it, so next_geq jumps over whole blocks without decoding them.
+
+    Parameters
+    ----------
+    data : bytes or memoryview
+        postings of the term, as written by codec.encode_postings
+    positional : bool
+        whether the postings have positions
+    format : str
+        varint or gamma
+    weight : callable
+        weight(i, doc_id, freq) gives the score contribution of the i-th posting
+    upper_bound : float
+        an upper bound of every weight of the term
+    block_bound : callable
+        block_bound(max_tf, min_doc_len) gives an upper bound of the weights of a block
+        from its skip entry, or None to use upper_bound for every block
+    cache : LRUCache
+        decoded blocks shared between cursors, stored under (cache_key, block number)
+    cache_key :
+        key of the term in the cache
+    """
+
+    def __init__(self, data, positional, format, weight, upper_bound, block_bound=None, cache=None, cache_key=None):
+        self.data = data
+        self.positional = positional
+        self.format = format
+        self.weight = weight
+        self.upper_bound = upper_bound
+        self.block_bound = block_bound
+        self.cache = cache
+        self.cache_key = cache_key
+        _, self.skips = read_skips(data)
+        self.last_doc_ids = [skip[0] for skip in self.skips]
+        self.last_doc = self.last_doc_ids[-1] if self.last_doc_ids else -1
+        self.block_bounds = [None] * len(self.skips)
+        self.evaluated = 0
+        self.decoded = 0
+        self.order = 0
+        self.block = -1
+        self.load_block(0)
+
+    def load_block(self, block):
+        self.block = block
+        self.pos = 0
+        if block >= len(self.skips):
+            self.postings = []
+            self.doc = END
+            return
+        self.postings = self.cache.get((self.cache_key, block)) if self.cache is not None else None
+        if self.postings is None:
+            self.postings = decode_block(self.data, self.skips, block, self.positional, self.format)
+            self.decoded += len(self.postings)
+            if self.cache is not None:
+                self.cache.put((self.cache_key, block), self.postings, postings_size(self.postings))
+        self.doc = self.postings[0][0]
+
+    def next(self):
+        self.pos += 1
+        if self.pos < len(self.postings):
+            self.doc = self.postings[self.pos][0]
+        else:
+            self.load_block(self.block + 1)
+
+    def next_geq(self, doc_id):
+        """Moves to the first posting with a doc id greater or equal to doc_id."""
+        if self.doc >= doc_id:
+            return
+        if self.last_doc_ids[self.block] < doc_id:
+            self.load_block(bisect_left(self.last_doc_ids, doc_id, self.block + 1))
+            if self.doc >= doc_id:
+                return
+        # doc_id is inside the current block
+        pos = self.pos
+        while self.postings[pos][0] < doc_id:
+            pos += 1
+        self.pos = pos
+        self.doc = self.postings[pos][0]
+
+    def block_upper_bound(self, doc_id):
+        """
+        Upper bound of the weight of the posting of doc_id, if the term has one, taken
+        from the skip entry of the block that could hold it, without decoding the block.
+        """
+        if self.block_bound is None:
+            return self.upper_bound
+        block = self.block if self.doc >= doc_id else bisect_left(self.last_doc_ids, doc_id, self.block)
+        if block >= len(self.skips):
+            return 0
+        if self.block_bounds[block] is None:
+            _, _, _, max_tf, min_doc_len = self.skips[block]
+            self.block_bounds[block] = self.block_bound(max_tf, min_doc_len)
+        return self.block_bounds[block]
+
+    def positions(self):
+        return self.postings[self.pos][1]
+
+    def score(self):
+        self.evaluated += 1
+        return self.weight(self.block * BLOCK_SIZE + self.pos, self.doc, self.postings[self.pos][2])
+
+
+class ChainedCursor:
+    """
+    Cursor over the postings of a term stored in several index segments (a base index and the
+    delta segments written by appends). Every segment holds higher doc ids than the ones before
+    it, so the postings are the postings of each segment cursor, one after the other.
+    """
+
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self.current = 0
+        self.upper_bound = max(cursor.upper_bound for cursor in cursors)
+        self.last_doc = max(cursor.last_doc for cursor in cursors)
+        self.order = 0
+        self.skip_exhausted()
+
+    @property
+    def doc(self):
+        return self.cursors[self.current].doc
+
+    @property
+    def evaluated(self):
+        return sum(cursor.evaluated for cursor in self.cursors)
+
+    @property
+    def decoded(self):
+        return sum(cursor.decoded for cursor in self.cursors)
+
+    def skip_exhausted(self):
+        while self.current < len(self.cursors) - 1 and self.cursors[self.current].doc == END:
+            self.current += 1
+
+    def next(self):
+        self.cursors[self.current].next()
+        self.skip_exhausted()
+
+    def next_geq(self, doc_id):
+        """Moves to the first posting with a doc id greater or equal to doc_id."""
+        while self.current < len(self.cursors) - 1 and self.cursors[self.current].last_doc < doc_id:
+            self.current += 1
+        self.cursors[self.current].next_geq(doc_id)
+        self.skip_exhausted()
+
+    def block_upper_bound(self, doc_id):
+        for cursor in self.cursors[self.current:]:
+            if cursor.last_doc >= doc_id:
+                return cursor.block_upper_bound(doc_id)
+        return 0
+
+    def positions(self):
+        return self.cursors[self.current].positions()
+
+    def score(self):
+        return self.cursors[self.current].score()
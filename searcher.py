@@ -1,103 +1,232 @@
 import math
+import heapq
+import mmap
 import argparse
 import json
+import os
+
+import numpy as np
+
+import vectorized
+from array import array
+from collections import defaultdict, deque
+from functools import lru_cache
+from lexicon import Lexicon, SegmentedLexicon, lexicon_filename
+from codec import decode_postings, index_filename, read_skips, decode_block
+from lru import LRUCache
+from postings import PostingsCursor, BlockPostingsCursor, ChainedCursor, END, postings_size
+from tokenizer import Tokenizer
+
+# rough memory used by a cached (doc_id, score) result
+RESULT_SIZE = 100
+# number of distinct query words whose normalized term is remembered
+NORMALIZE_CACHE_SIZE = 1 << 16
+# the heap only beats sorting every scored document when top_k is below this fraction of them
+HEAP_MAX_FRACTION = 0.1
 
-from collections import defaultdict
 
 class Searcher:
     
-    def __init__(self, index_folder_path):
-        self.index_file_path = index_folder_path+"/index.txt"
-        self.doc_lengths = self.load_docs_len(index_folder_path+"/docs_len.txt")
+    def __init__(self, index_folder_path, engine="python", postings_cache_mb=64, results_cache_mb=0):
         self.total_docs, self.avgdl = self.load_docs_info(index_folder_path+"/docs_info.txt")
-        self.doc_mapping = self.load_doc_mapping(index_folder_path+"/doc_mapping.txt")
-        self.term_frequencies_path = index_folder_path+"/term_frequencies.txt"
+        self.tokenizer = self.load_tokenizer(index_folder_path)
+        # the base index and the delta segments written by appends (--indexer.append), in order
+        self.indexes = [self.load_index(index_folder_path+"/"+index_filename(self.format, segment)) for segment in range(self.n_segments)]
+        self.doc_lengths = self.load_array(index_folder_path+"/docs_len.bin", "I")
+        self.doc_norms = self.load_array(index_folder_path+"/docs_norm.bin", "f")
+        self.doc_mapping = self.load_array(index_folder_path+"/doc_mapping.bin", "Q")
+        self.lexicons = [self.load_lexicon(index_folder_path+"/"+lexicon_filename(segment)) for segment in range(self.n_segments)]
+        self.lexicon = self.lexicons[0] if self.n_segments == 1 else SegmentedLexicon(self.lexicons)
+        # weights precomputed by the indexer (--indexer.storing.*.cache_in_disk), if any. Appends drop them,
+        # so they only exist for indexes with a single segment
+        self.bm25_cache = self.load_array(index_folder_path+"/bm25_cache.bin", "f") if self.bm25_cache_params else None
+        self.tfidf_cache = self.load_array(index_folder_path+"/tfidf_cache.bin", "f") if self.tfidf_cache_smart else None
+        # number of postings scored by bm25_search and decoded from the index (postings read from
+        # the postings cache are not decoded again), to measure the effect of pruning
+        self.postings_evaluated = 0
+        self.postings_decoded = 0
+        # decoded postings (a block of a binary index, or the whole list of a text index, per entry)
+        # and numpy arrays of hot terms, and optionally whole query results, kept in memory
+        self.postings_cache = LRUCache(int(postings_cache_mb * 1024 * 1024))
+        self.results_cache = LRUCache(int(results_cache_mb * 1024 * 1024))
+        # postings of the terms of the current batch of queries (see search_batch), read once for all of them
+        self.preloaded = {}
+        # python scores one posting at a time, numpy one postings list at a time (see vectorized.py)
+        self.engine = engine
+        if engine == "numpy":
+            self.doc_lengths_array = np.asarray(self.doc_lengths, dtype=np.float32)
+            self.doc_norms_array = np.asarray(self.doc_norms, dtype=np.float32)
     
     def load_docs_info(self, file_path):
         try:
             with open(file_path, "r") as file:
-                lines = file.read().splitlines()
-                total_docs = int(lines[0].split(':')[1])
-                avgdl = float(lines[1].split(':')[1])
+                info = dict(line.split(':', 1) for line in file.read().splitlines())
+                total_docs = int(info["total_docs"])
+                avgdl = float(info["avgdl"])
+                # indexes built before the binary formats only have the text one
+                self.format = info.get("format", "text")
+                self.positional = info.get("positional") == "True"
+                self.bm25_cache_params = (float(info["bm25.k1"]), float(info["bm25.b"])) if "bm25.k1" in info else None
+                self.tfidf_cache_smart = info.get("tfidf.smart")
+                self.n_segments = int(info.get("segments", 1))
+                self.tokenizer_config = {key[len("tokenizer."):]: value for key, value in info.items() if key.startswith("tokenizer.")}
                 return total_docs, avgdl
         except Exception as e:
             print(f"Error reading index (load_docs_info): {e}")
 
-    def load_docs_len(self, file_path) -> dict:
+    def load_tokenizer(self, index_folder_path):
+        # indexes built before the tokenizer settings were stored fall back to splitting on whitespace
+        if not self.tokenizer_config:
+            return None
         try:
-            document_lengths = {}
-            with open(file_path, "r") as file:
-                for line in file:
-                    doc_id, lenght = line.strip().split(':')
-                    document_lengths[doc_id] = int(lenght)
-            return document_lengths
+            config = dict(self.tokenizer_config)
+            if config["stopwords_path"] != "None":
+                config["stopwords_path"] = os.path.join(index_folder_path, config["stopwords_path"])
+            tokenizer = Tokenizer.from_config(config, self.positional)
+            # queries repeat words, so each word is normalized (and stemmed) only once
+            self.normalize = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(tokenizer.normalize)
+            return tokenizer
         except Exception as e:
-            print(f"Error reading index (document_lengths): {e}")
+            print(f"Error reading index (load_tokenizer): {e}")
 
-    def load_doc_mapping(self, file_path) -> dict:
+    def load_index(self, file_path) -> memoryview:
+        # the index is mapped read-only, so every searcher process on the machine shares the same page cache
+        # and postings are decoded straight from the mapping without reading or copying the file
         try:
-            doc_mapping = {}
-            with open(file_path, "r") as file:
-                for line in file:
-                    pmid, doc_id = line.strip().split(':')
-                    doc_mapping[doc_id] = pmid
-            return doc_mapping
+            with open(file_path, "rb") as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    return memoryview(b"")
+                return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
         except Exception as e:
-            print(f"Error reading index (load_doc_mapping): {e}")
+            print(f"Error reading index (load_index): {e}")
 
-    def get_term_frequency(self, expected_term) -> int:
+    def load_array(self, file_path, typecode):
+        # document metadata is stored as one value per doc id (docs_len.bin: length, docs_norm.bin: lnc norm,
+        # doc_mapping.bin: pmid),
+        # the file is mapped and read in place, so loading it costs nothing and the pages are shared
         try:
-            with open(self.term_frequencies_path, "r") as file:
-                for line in file:
-                    term, freq = line.strip().split(':')
-                    if term == expected_term:
-                        return int(freq)
-            return None
+            with open(file_path, "rb") as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    return array(typecode)
+                return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+        except Exception as e:
+            print(f"Error reading index (load_array): {e}")
+
+    def load_lexicon(self, file_path) -> Lexicon:
+        try:
+            lexicon = Lexicon(file_path)
+            print(f"Lexicon loaded: {len(lexicon)} terms, {round(lexicon.memory_usage() / 1024 / 1024, 2)} MB")
+            return lexicon
         except Exception as e:
-            print(f"Error reading index (get_term_frequency): {e}")
+            print(f"Error reading index (load_lexicon): {e}")
+
+    def get_document_frequency(self, term) -> int:
+        term_id = self.lexicon.lookup(term)
+        return self.lexicon.df[term_id] if term_id != -1 else 0
+
+    def get_collection_frequency(self, term) -> int:
+        term_id = self.lexicon.lookup(term)
+        return self.lexicon.cf[term_id] if term_id != -1 else 0
+
+    def term_segments(self, term_id) -> list:
+        """
+        (key, data) of the encoded postings of a term in every segment that holds it, in doc id order,
+        where key, (segment, term id inside the segment), identifies them in the postings cache.
+        """
+        segments = []
+        for segment, local_id in self.lexicon.locations(term_id):
+            lexicon = self.lexicons[segment]
+            offset = lexicon.offset[local_id]
+            segments.append(((segment, local_id), self.indexes[segment][offset:offset + lexicon.length[local_id]]))
+        return segments
+
+    def storage_order(self, term_id):
+        """Segment and offset of the first postings of a term, to read several terms sequentially."""
+        segment, local_id = self.lexicon.locations(term_id)[0]
+        return segment, self.lexicons[segment].offset[local_id]
+
+    def decode_term(self, term_id) -> list:
+        if term_id in self.preloaded:
+            return self.preloaded[term_id]
+        postings = []
+        for key, data in self.term_segments(term_id):
+            if self.format == "text":
+                postings += self.cached_postings((key, 0), lambda: decode_postings(data, self.positional, self.format))
+                continue
+            _, skips = read_skips(data)
+            for block in range(len(skips)):
+                postings += self.cached_postings((key, block), lambda: decode_block(data, skips, block, self.positional, self.format))
+        return postings
+
+    def cached_postings(self, key, decode):
+        postings = self.postings_cache.get(key)
+        if postings is None:
+            postings = decode()
+            self.postings_decoded += len(postings)
+            self.postings_cache.put(key, postings, postings_size(postings))
+        return postings
+
+    def cache_stats(self):
+        return {"postings": self.postings_cache.stats(), "results": self.results_cache.stats()}
+
+    def get_impacts(self, cache, term):
+        """Weights cached by the indexer for the postings of a term, in the same order as the postings."""
+        term_id = self.lexicon.lookup(term)
+        if term_id == -1:
+            return []
+        first_posting = self.lexicon.first_posting[term_id]
+        return cache[first_posting:first_posting + self.lexicon.df[term_id]]
 
-    def read_index(self):
+    def get_postings(self, term) -> list:
+        """Decodes the postings of a term straight from the mapped index using the lexicon offsets."""
+        term_id = self.lexicon.lookup(term)
+        if term_id == -1:
+            return []
         try:
-            with open(self.index_file_path, 'r') as file:
-                for line in file:
-                    parts = line.strip().split(';')
-                    term = parts[0]
-                    postings = []
-                    for posting in parts[1:]:
-                        if ':' in posting:  # Positional
-                            doc_id, positions = posting.split(':')
-                            positions = list(map(int, positions.split(',')))
-                            postings.append((doc_id, positions, len(positions)))  # Include frequency
-                        else:  # Non-positional
-                            doc_id, freq = posting.split(',')
-                            postings.append((doc_id, [], int(freq)))  # Empty list for positions
-                    yield term, postings
-                return None, None
+            return self.decode_term(term_id)
         except Exception as e:
-            print(f"Error reading index (read_index): {e}")
+            print(f"Error reading index (get_postings): {e}")
+            return []
 
     def tokenize(self, text: str):
-        return text.lower().split()
+        """Terms of a query, produced by the same tokenizer the documents went through."""
+        if self.tokenizer is None:
+            return text.lower().split()
+        terms = []
+        for word in self.tokenizer.words(text):
+            term = self.normalize(word)
+            if term is not None:
+                terms.append(term)
+        return terms
     
-    def tf_idf_search(self, query: str, smart_notation='lnc.ltc'):
+    def top_documents(self, doc_scores, top_k=None):
+        """
+        The top_k (doc_id, score) pairs with the highest scores, best first, ties going
+        to the smallest doc id. When top_k is small next to the number of scored documents a
+        heap of size top_k is used, so the documents that are not returned are never sorted.
+        """
+        if top_k is None or top_k >= HEAP_MAX_FRACTION * len(doc_scores):
+            return sorted(doc_scores.items(), key=lambda x: (x[1], -x[0]), reverse=True)[:top_k]
+        return heapq.nlargest(top_k, doc_scores.items(), key=lambda x: (x[1], -x[0]))
+
+    def tf_idf_search(self, query: str, smart_notation='lnc.ltc', top_k=None):
         if smart_notation == 'lnc.ltc':
-            return self.tf_idf_search_lnc_ltc(query)
+            return self.tf_idf_search_lnc_ltc(query, top_k)
         elif smart_notation == 'bnn.bnc':
-            return self.tf_idf_search_bnn_bnc(query)
+            return self.tf_idf_search_bnn_bnc(query, top_k)
         else:
             print(f"SMART notation {smart_notation} not recognized.")
             return []
         
-    def tf_idf_search_lnc_ltc(self, query: str):
+    def tf_idf_search_lnc_ltc(self, query: str, top_k=None):
         query_terms = self.tokenize(query)
         doc_scores = defaultdict(float)
         query_weights = defaultdict(float)
         
         query_norm = 0
         for term in query_terms:
-            term_freq = self.get_term_frequency(term)
-            if term_freq:
-                df = term_freq
+            df = self.get_document_frequency(term)
+            if df:
                 idf = math.log(self.total_docs / df)
                 query_weights[term] += (1 + math.log(query_terms.count(term))) * idf
                 query_norm += query_weights[term] ** 2
@@ -106,186 +235,466 @@ class Searcher:
         if query_norm == 0:
             return []
 
-        for term, postings in self.read_index():
-            if term in query_terms:
-                
-                for doc_id, _, freq in postings:
-                    tf = 1 + math.log(freq)
-                    doc_norm = math.sqrt(self.doc_lengths.get(doc_id, 1))
-                    doc_scores[doc_id] += (tf / doc_norm) * (query_weights[term] / query_norm)
+        if self.engine == "numpy":
+            return self.tf_idf_search_lnc_ltc_numpy(query_weights, query_norm, top_k)
+
+        if self.tfidf_cache_smart == 'lnc.ltc':
+            # document weights were computed by the indexer, scoring is a sum of stored weights
+            for term in query_weights:
+                query_weight = query_weights[term] / query_norm
+                for (doc_id, _, _), weight in zip(self.get_postings(term), self.get_impacts(self.tfidf_cache, term)):
+                    doc_scores[doc_id] += weight * query_weight
+            return self.top_documents(doc_scores, top_k)
+
+        for term in query_weights:
+            for doc_id, _, freq in self.get_postings(term):
+                tf = 1 + math.log(freq)
+                doc_norm = self.doc_norms[doc_id]
+                doc_scores[doc_id] += (tf / doc_norm) * (query_weights[term] / query_norm)
 
-        return sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
+        return self.top_documents(doc_scores, top_k)
 
-    def tf_idf_search_bnn_bnc(self, query: str):
+    def tf_idf_search_bnn_bnc(self, query: str, top_k=None):
         query_terms = set(self.tokenize(query))
         query_norm = math.sqrt(len(query_terms))
 
         doc_scores = defaultdict(float)
 
-        for term, postings in self.read_index():
-            if term in query_terms:
-                for doc_id, _, _ in postings:
-                    tf = 1
-                    doc_norm = math.sqrt(self.doc_lengths.get(doc_id, 1))
-                    if doc_norm != 0:
-                        doc_scores[doc_id] += (tf / doc_norm) / query_norm
+        if self.engine == "numpy":
+            return self.tf_idf_search_bnn_bnc_numpy(query_terms, query_norm, top_k)
+
+        if self.tfidf_cache_smart == 'bnn.bnc':
+            for term in query_terms:
+                for (doc_id, _, _), weight in zip(self.get_postings(term), self.get_impacts(self.tfidf_cache, term)):
+                    doc_scores[doc_id] += weight / query_norm
+            return self.top_documents(doc_scores, top_k)
+
+        for term in query_terms:
+            for doc_id, _, _ in self.get_postings(term):
+                tf = 1
+                doc_norm = math.sqrt(self.doc_lengths[doc_id])
+                if doc_norm != 0:
+                    doc_scores[doc_id] += (tf / doc_norm) / query_norm
 
-        ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked_docs
+        return self.top_documents(doc_scores, top_k)
 
-    def bm25_search(self, query, k1=1.2, b=0.75):
+    def bm25_search(self, query, k1=1.2, b=0.75, top_k=None, pruning=True, proximity_boost=0):
         query_terms = self.tokenize(query)
         doc_scores = defaultdict(float)
 
-        for term, postings in self.read_index():
-            if term in query_terms:
-                df = len(postings)
-                idf = math.log((self.total_docs - df + 0.5) / (df + 0.5) + 1) if df > 0 else 0
+        if proximity_boost and len(set(query_terms)) > 1:
+            # documents with all the terms close together get an extra score, the whole proximity_boost
+            # when they appear next to each other and less as their minimal window grows
+            doc_scores = dict(self.bm25_search(query, k1, b))
+            n_terms = len(set(query_terms))
+            for doc_id, span in self.proximity_windows(query_terms).items():
+                doc_scores[doc_id] += proximity_boost / (1 + span - (n_terms - 1))
+            return self.top_documents(doc_scores, top_k)
+
+        if self.engine == "numpy":
+            return self.bm25_search_numpy(query_terms, k1, b, top_k)
+
+        if top_k is not None and pruning:
+            return self.bm25_search_maxscore(query_terms, k1, b, top_k)
+
+        if self.bm25_cache_params == (k1, b):
+            # the whole bm25 weight of every posting was computed by the indexer
+            for term in dict.fromkeys(query_terms):
+                for (doc_id, _, _), weight in zip(self.get_postings(term), self.get_impacts(self.bm25_cache, term)):
+                    doc_scores[doc_id] += weight
+                    self.postings_evaluated += 1
+            return self.top_documents(doc_scores, top_k)
+
+        for term in dict.fromkeys(query_terms):
+            postings = self.get_postings(term)
+            df = len(postings)
+            idf = math.log((self.total_docs - df + 0.5) / (df + 0.5) + 1) if df > 0 else 0
+
+            for doc_id, _, freq in postings:
+                tf = freq
+                doc_len = self.doc_lengths[doc_id]
+                norm_tf = (tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_len / self.avgdl)))
+                doc_scores[doc_id] += idf * norm_tf
+            self.postings_evaluated += len(postings)
+
+        return self.top_documents(doc_scores, top_k)
+
+    def term_arrays(self, term_id):
+        key = ("arrays", term_id)
+        if key in self.preloaded:
+            return self.preloaded[key]
+        arrays = self.postings_cache.get(key)
+        if arrays is None:
+            segments = [vectorized.postings_arrays(data, self.positional, self.format) for _, data in self.term_segments(term_id)]
+            arrays = segments[0] if len(segments) == 1 else tuple(np.concatenate(column) for column in zip(*segments))
+            self.postings_decoded += len(arrays[0])
+            self.postings_cache.put(key, arrays, sum(array.nbytes for array in arrays))
+        return arrays
+
+    def cached_weights(self, cache, term_id):
+        first_posting = self.lexicon.first_posting[term_id]
+        return np.asarray(cache[first_posting:first_posting + self.lexicon.df[term_id]])
+
+    def tf_idf_search_lnc_ltc_numpy(self, query_weights, query_norm, top_k=None):
+        scores = np.zeros(self.total_docs, dtype=np.float32)
+        scored = []
+        for term, query_weight in query_weights.items():
+            term_id = self.lexicon.lookup(term)
+            doc_ids, freqs = self.term_arrays(term_id)
+            if self.tfidf_cache_smart == 'lnc.ltc':
+                weights = self.cached_weights(self.tfidf_cache, term_id)
+            else:
+                weights = (1 + np.log(freqs, dtype=np.float32)) / self.doc_norms_array[doc_ids]
+            np.add.at(scores, doc_ids, weights * np.float32(query_weight / query_norm))
+            scored.append(doc_ids)
+        return vectorized.top_documents(scores, scored, top_k)
+
+    def tf_idf_search_bnn_bnc_numpy(self, query_terms, query_norm, top_k=None):
+        scores = np.zeros(self.total_docs, dtype=np.float32)
+        scored = []
+        for term in query_terms:
+            term_id = self.lexicon.lookup(term)
+            if term_id == -1:
+                continue
+            doc_ids, _ = self.term_arrays(term_id)
+            if self.tfidf_cache_smart == 'bnn.bnc':
+                weights = self.cached_weights(self.tfidf_cache, term_id)
+            else:
+                doc_ids = doc_ids[self.doc_lengths_array[doc_ids] != 0]
+                weights = 1 / np.sqrt(self.doc_lengths_array[doc_ids])
+            np.add.at(scores, doc_ids, weights / np.float32(query_norm))
+            scored.append(doc_ids)
+        return vectorized.top_documents(scores, scored, top_k)
+
+    def bm25_search_numpy(self, query_terms, k1, b, top_k=None):
+        scores = np.zeros(self.total_docs, dtype=np.float32)
+        scored = []
+        for term in dict.fromkeys(query_terms):
+            term_id = self.lexicon.lookup(term)
+            if term_id == -1:
+                continue
+            doc_ids, freqs = self.term_arrays(term_id)
+            if self.bm25_cache_params == (k1, b):
+                weights = self.cached_weights(self.bm25_cache, term_id)
+            else:
+                df = len(doc_ids)
+                idf = math.log((self.total_docs - df + 0.5) / (df + 0.5) + 1)
+                tf = freqs.astype(np.float32)
+                doc_len = self.doc_lengths_array[doc_ids]
+                weights = np.float32(idf) * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_len / self.avgdl))))
+            np.add.at(scores, doc_ids, weights.astype(np.float32))
+            scored.append(doc_ids)
+            self.postings_evaluated += len(doc_ids)
+        return vectorized.top_documents(scores, scored, top_k)
+
+    def cursor(self, term_id, weight, upper_bound, block_bound=None):
+        """
+        Cursor over the postings of a term. Binary indexes get a BlockPostingsCursor, which only
+        decodes the blocks it stops in (chained over the segments of an appended index), text
+        indexes (and preloaded terms) a PostingsCursor over the decoded postings.
+        """
+        if self.format == "text" or term_id in self.preloaded:
+            return PostingsCursor(self.decode_term(term_id), weight, upper_bound)
+        cursors = [BlockPostingsCursor(data, self.positional, self.format, weight, upper_bound, block_bound,
+                                       self.postings_cache, key)
+                   for key, data in self.term_segments(term_id)]
+        return cursors[0] if len(cursors) == 1 else ChainedCursor(cursors)
+
+    def bm25_cursor(self, term_id, k1, b):
+        """Cursor over the bm25 weights of a term, with the upper bound of its weights taken from the lexicon."""
+        df = self.lexicon.df[term_id]
+        idf = math.log((self.total_docs - df + 0.5) / (df + 0.5) + 1)
+
+        # the weight grows with tf and shrinks with the document length, so the highest tf
+        # and the shortest document of the term (or of a block) bound every weight
+        def bound(max_tf, min_doc_len):
+            return idf * ((max_tf * (k1 + 1)) / (max_tf + k1 * (1 - b + b * (min_doc_len / self.avgdl))))
+
+        if self.bm25_cache_params == (k1, b):
+            first_posting = self.lexicon.first_posting[term_id]
+            weights = self.bm25_cache[first_posting:first_posting + df]
+            return self.cursor(term_id, lambda i, doc_id, tf: weights[i], self.lexicon.max_impact[term_id], bound)
+
+        def weight(i, doc_id, tf):
+            norm_tf = (tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (self.doc_lengths[doc_id] / self.avgdl)))
+            return idf * norm_tf
+
+        upper_bound = bound(self.lexicon.max_tf[term_id], self.lexicon.min_doc_len[term_id])
+        return self.cursor(term_id, weight, upper_bound, bound)
+
+    def bm25_search_maxscore(self, query_terms, k1, b, top_k):
+        """
+        Document-at-a-time bm25 with MaxScore pruning. Returns the same top_k documents as
+        the exhaustive search, but the postings of terms whose upper bounds can not take a
+        document above the current k-th score are only looked at for the candidate documents,
+        and a candidate is dropped as soon as the block-max bounds of those terms show it
+        can not get there, before their blocks are decoded.
+        """
+        cursors = []
+        for order, term in enumerate(dict.fromkeys(query_terms)):
+            term_id = self.lexicon.lookup(term)
+            if term_id != -1:
+                cursor = self.bm25_cursor(term_id, k1, b)
+                cursor.order = order
+                cursors.append(cursor)
+        if not cursors or top_k <= 0:
+            return []
+
+        # terms sorted by upper bound, cumulative_bounds[i] is the best score a document
+        # can get from the terms 0..i (with a small slack for rounding errors)
+        cursors.sort(key=lambda cursor: cursor.upper_bound)
+        cumulative_bounds = []
+        total = 0
+        for cursor in cursors:
+            total += cursor.upper_bound * (1 + 1e-6)
+            cumulative_bounds.append(total)
+
+        top = []  # min heap of (score, -doc_id)
+        threshold = -1
+        first_essential = 0  # terms before this one can not, alone, take a document into the top_k
+
+        while first_essential < len(cursors):
+            essential = cursors[first_essential:]
+            doc_id = min(cursor.doc for cursor in essential)
+            if doc_id == END:
+                break
 
-                for doc_id, _, freq in postings:
-                    tf = freq
-                    doc_len = self.doc_lengths.get(doc_id, 1)
-                    norm_tf = (tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_len / self.avgdl)))
-                    doc_scores[doc_id] += idf * norm_tf
+            score = 0
+            weights = []
+            for cursor in essential:
+                if cursor.doc == doc_id:
+                    weight = cursor.score()
+                    score += weight
+                    weights.append((cursor.order, weight))
+                    cursor.next()
+
+            for i in range(first_essential - 1, -1, -1):
+                if score + cumulative_bounds[i] <= threshold:
+                    break
+                cursor = cursors[i]
+                rest = cumulative_bounds[i - 1] if i > 0 else 0
+                if score + cursor.block_upper_bound(doc_id) * (1 + 1e-6) + rest <= threshold:
+                    break
+                cursor.next_geq(doc_id)
+                if cursor.doc == doc_id:
+                    weight = cursor.score()
+                    score += weight
+                    weights.append((cursor.order, weight))
+
+            # the final score adds the weights in query order, like the exhaustive search, so both give the same floats
+            score = 0
+            for _, weight in sorted(weights):
+                score += weight
+
+            # documents come in increasing doc id order, so a tie with the k-th score is never an improvement
+            if len(top) < top_k:
+                heapq.heappush(top, (score, -doc_id))
+            elif score > top[0][0]:
+                heapq.heapreplace(top, (score, -doc_id))
+
+            if len(top) == top_k:
+                threshold = top[0][0]
+                while first_essential < len(cursors) and cumulative_bounds[first_essential] <= threshold:
+                    first_essential += 1
+
+        self.postings_evaluated += sum(cursor.evaluated for cursor in cursors)
+        self.postings_decoded += sum(cursor.decoded for cursor in cursors)
+        return [(-doc_id, score) for score, doc_id in sorted(top, reverse=True)]
+
+    def search(self, query, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost=0):
+        # queries that tokenize to the same terms share their results
+        key = (tuple(self.tokenize(query)), top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost)
+        results = self.results_cache.get(key)
+        if results is None:
+            results = self.rank(query, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost)
+            self.results_cache.put(key, results, RESULT_SIZE * (len(results) + 1))
+        return results
 
-        return sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
+    def rank(self, query, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost=0):
+        # Determine the set of documents to consider based on search type
+        if search_type == 'phrase':
+            doc_ids = set(self.phrase_search(query))
+        elif search_type == 'proximity':
+            doc_ids = set(self.proximity_search(query, max_distance))
+        else:  # 'standard' search type
+            doc_ids = None  # All documents are candidates
 
-    def interactive_mode(self, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b):
+        # With phrase or proximity search only the candidates are ranked, so the top_k is taken
+        # after discarding the other documents and matches below the unfiltered top_k are kept
+        ranking_top_k = top_k if doc_ids is None else None
+
+        results = []
+        if ranking_method == 'tf-idf':
+            results = self.tf_idf_search(query, smart_notation, ranking_top_k)
+        elif ranking_method == 'bm25':
+            results = self.bm25_search(query, k1, b, ranking_top_k, proximity_boost=proximity_boost)
+
+        if doc_ids is not None:
+            results = [res for res in results if res[0] in doc_ids][:top_k]
+        return results
+
+    def interactive_mode(self, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost=0):
 
         while True:
             query = input("Enter your query (or 'exit' to quit): ")
             if query.lower() == 'exit':
                 break
 
-            # Determine the set of documents to consider based on search type
-            if search_type == 'phrase':
-                doc_ids = self.phrase_search(query)
-            elif search_type == 'proximity':
-                doc_ids = self.proximity_search(query, max_distance)
-            else:  # 'standard' search type
-                doc_ids = None  # All documents are candidates
-
-            # Perform the ranking
-            results = []
-            if ranking_method == 'tf-idf':
-                results = self.tf_idf_search(query, smart_notation)[:top_k]
-            elif ranking_method == 'bm25':
-                results = self.bm25_search(query, k1, b)[:top_k]
-
-            # Filter results based on doc_ids if phrase or proximity search was used
-            if doc_ids is not None:
-                results = [res for res in results if res[0] in doc_ids]
+            results = self.search(query, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost)
 
             # Print results
             for rank, (doc_id, score) in enumerate(results, start=1):
-                print(f"{rank}. Document: {doc_id}, Score: {score}")
+                print(f"{rank}. Document: {self.doc_mapping[doc_id]}, Score: {score}")
 
 
-    def batch_mode(self, path_to_queries, output_file, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b):
+    def search_batch(self, queries, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost=0):
+        """
+        Results of several queries, as search would give them. The postings of the union of
+        their terms are decoded once, in index order so the index is read sequentially, and
+        every query is then scored from memory.
+        """
+        terms = set(term for query in queries for term in self.tokenize(query))
+        term_ids = sorted(set(self.lexicon.lookup(term) for term in terms) - {-1}, key=self.storage_order)
+        try:
+            for term_id in term_ids:
+                if self.engine == "numpy":
+                    self.preloaded[("arrays", term_id)] = self.term_arrays(term_id)
+                # the numpy engine only needs the decoded postings to match phrases and proximity
+                if self.engine != "numpy" or search_type != "standard":
+                    self.preloaded[term_id] = self.decode_term(term_id)
+            return [self.search(query, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost) for query in queries]
+        finally:
+            self.preloaded = {}
+
+    def batch_mode(self, path_to_queries, output_file, top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost=0, batch_size=None):
 
         with open(path_to_queries, 'r') as file:
             with open(output_file, 'w') as out:  # Open file in append mode
                 pass
-            for line in file:
-                query_data = json.loads(line)
-                query_text = query_data["query_text"]
-                query_id = query_data["query_id"]
-
-                # Determine the set of documents to consider based on search type
-                if search_type == 'phrase':
-                    doc_ids = self.phrase_search(query_text)
-                elif search_type == 'proximity':
-                    doc_ids = self.proximity_search(query_text, max_distance)
-                else:
-                    doc_ids = None  # All documents are candidates
-
-                # Perform the ranking
-                if ranking_method == 'tf-idf':
-                    results = self.tf_idf_search(query_text, smart_notation)[:top_k]
-                elif ranking_method == 'bm25':
-                    results = self.bm25_search(query_text, k1, b)[:top_k]
-
-                # Filter results based on doc_ids if phrase or proximity search was used
-                if doc_ids is not None:
-                    results = [res for res in results if res[0] in doc_ids]
-
-                # Write results to output file
-                with open(output_file, 'a') as out:  # Open file in append mode
-                    documents = [self.doc_mapping[doc_id] for doc_id, _ in results]
-                    response = json.dumps({"query_id": query_id, "documents_pmid": documents})
+            queries = [json.loads(line) for line in file]
+
+        # batch_size queries are evaluated together, reading the postings of their terms only once
+        batch_size = batch_size or 1
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            if batch_size == 1:
+                results = [self.search(batch[0]["query_text"], top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost)]
+            else:
+                results = self.search_batch([query_data["query_text"] for query_data in batch], top_k, ranking_method, search_type, smart_notation, max_distance, k1, b, proximity_boost)
+
+            # Write results to output file
+            with open(output_file, 'a') as out:  # Open file in append mode
+                for query_data, query_results in zip(batch, results):
+                    documents = [str(self.doc_mapping[doc_id]) for doc_id, _ in query_results]
+                    response = json.dumps({"query_id": query_data["query_id"], "documents_pmid": documents})
                     out.write(response + "\n")
 
+    def intersect(self, terms):
+        """
+        Yields (doc_id, positions) for every document that contains all the terms, in doc id
+        order, where positions maps each term to its positions in the document. Each term's
+        postings are read once: the rarest term leads and the cursors of the others jump to
+        its doc ids with next_geq, so blocks between two matches are not decoded.
+        """
+        term_ids = {term: self.lexicon.lookup(term) for term in terms}
+        if not term_ids or -1 in term_ids.values():
+            return
+        rarest_first = sorted(term_ids.items(), key=lambda item: self.lexicon.df[item[1]])
+        term_cursors = {term: self.cursor(term_id, None, 0) for term, term_id in rarest_first}
+        cursors = list(term_cursors.values())
+
+        doc_id = cursors[0].doc
+        while doc_id != END:
+            for cursor in cursors[1:]:
+                cursor.next_geq(doc_id)
+                if cursor.doc != doc_id:
+                    break
+            else:
+                yield doc_id, {term: cursor.positions() for term, cursor in term_cursors.items()}
+                cursors[0].next()
+                doc_id = cursors[0].doc
+                continue
+            # some term has no posting for doc_id, move the leader to the next doc id that term has
+            cursors[0].next_geq(cursor.doc)
+            doc_id = cursors[0].doc
+
     def phrase_search(self, query):
         query_terms = self.tokenize(query)
         if not query_terms:
             return []
 
-        init_sets = []
-        for term, postings in self.read_index():
-            if term in query_terms:
-                init_sets.append(set(doc_id for doc_id, _, freq in postings)) 
-
-        candidate_docs = set()
-        if len(init_sets) != 0:
-            candidate_docs = set.intersection(*init_sets)
-
         results = []
-        for doc_id in candidate_docs:
-            term_positions = [self.get_term_positions(term, doc_id) for term in query_terms]
+        for doc_id, positions in self.intersect(query_terms):
+            term_positions = [positions[term] for term in query_terms]
 
             if self.check_terms_in_sequence(term_positions):
                 results.append(doc_id)
 
         return results
 
-    def get_term_positions(self, term, doc_id):
-        """Retrieve positions for a term in a specific document."""
-        for _, postings in self.read_index():
-            for posting in postings:
-                if posting[0] == doc_id:
-                    return posting[1]
-        return []
-
     def check_terms_in_sequence(self, term_positions):
-        """Check if the terms appear in sequence."""
-        for i in range(len(term_positions) - 1):
-            current_positions = term_positions[i]
-            next_positions = term_positions[i + 1]
-            if not any(npos == cpos + 1 for cpos in current_positions for npos in next_positions):
-                return False
-        return True
-
-    def are_terms_within_distance(self, term_positions, max_distance):
-        """Check if terms are within max_distance in a document."""
-        for i in range(len(term_positions) - 1):
-            for pos1 in term_positions[i]:
-                for j in range(i+1, len(term_positions)):
-                    if any(abs(pos2 - pos1) <= max_distance for pos2 in term_positions[j]):
-                        return True
-        return False
+        """
+        Check if the terms appear in sequence, as one phrase. The sorted positions of each
+        term are merged with the phrase starts that are still possible, shifted by the
+        offset of the term in the phrase.
+        """
+        starts = term_positions[0]
+        for offset, positions in enumerate(term_positions[1:], start=1):
+            matches = []
+            i = j = 0
+            while i < len(starts) and j < len(positions):
+                target = starts[i] + offset
+                if positions[j] < target:
+                    j += 1
+                elif positions[j] > target:
+                    i += 1
+                else:
+                    matches.append(starts[i])
+                    i += 1
+                    j += 1
+            starts = matches
+        return len(starts) > 0
+
+    def minimal_window(self, term_positions):
+        """
+        Span (last - first position) of the smallest window of the document that holds every
+        term, or None if some term is missing. The sorted positions of all terms are swept in
+        order, keeping the window that ends at the current position as short as possible.
+        """
+        if not term_positions or not all(term_positions):
+            return None
+        occurrences = heapq.merge(*[[(position, term) for position in positions] for term, positions in enumerate(term_positions)])
+        counts = [0] * len(term_positions)
+        covered = 0
+        window = deque()
+        best = None
+        for position, term in occurrences:
+            window.append((position, term))
+            if counts[term] == 0:
+                covered += 1
+            counts[term] += 1
+            while covered == len(term_positions):
+                start, first_term = window.popleft()
+                if best is None or position - start < best:
+                    best = position - start
+                counts[first_term] -= 1
+                if counts[first_term] == 0:
+                    covered -= 1
+        return best
+
+    def proximity_windows(self, query_terms):
+        """Span of the minimal window of every document that contains all the query terms."""
+        terms = list(dict.fromkeys(query_terms))
+        windows = {}
+        for doc_id, positions in self.intersect(terms):
+            span = self.minimal_window([positions[term] for term in terms])
+            if span is not None:
+                windows[doc_id] = span
+        return windows
 
     def proximity_search(self, query, max_distance):
-        query_terms = self.tokenize(query)
-        if not query_terms:
-            return []
-
-        init_sets = []
-        for term, postings in self.read_index():
-            if term in query_terms:
-                init_sets.append(set(doc_id for doc_id, _, freq in postings)) 
-
-        candidate_docs = set()
-        if len(init_sets) != 0:
-            candidate_docs = set.intersection(*init_sets)
-        
-        results = []
-        for doc_id in candidate_docs:
-            term_positions = [self.get_term_positions(term, doc_id) for term in query_terms]
-
-            if self.are_terms_within_distance(term_positions, max_distance):
-                results.append(doc_id)
-
-        return results
+        """Documents where all the query terms appear inside a window spanning at most max_distance positions."""
+        return [doc_id for doc_id, span in self.proximity_windows(self.tokenize(query)).items() if span <= max_distance]
 
 from time import time
 
@@ -302,11 +711,16 @@ if __name__ == "__main__":
     parser.add_argument('--k1', type=float, default=1.2, help='k1 parameter for BM25')
     parser.add_argument('--b', type=float, default=0.75, help='b parameter for BM25')
     parser.add_argument('--search_type', type=str, default='standard', choices=['standard', 'phrase', 'proximity'], help='Type of search')
-    parser.add_argument('--max_distance', type=int, default=0, help='Max distance for proximity search')
+    parser.add_argument('--max_distance', type=int, default=0, help='Max distance for proximity search, the span of the smallest window holding every query term')
+    parser.add_argument('--proximity_boost', type=float, default=0, help='Score added by BM25 to documents with the query terms close together (0 disables it)')
+    parser.add_argument('--postings_cache_mb', type=float, default=64, help='Memory for decoded postings of frequent terms, in MB (0 disables the cache)')
+    parser.add_argument('--results_cache_mb', type=float, default=0, help='Memory for the results of repeated queries, in MB (0 disables the cache)')
+    parser.add_argument('--batch_size', type=int, default=None, help='Number of queries of the batch mode evaluated together, reading the postings of their terms once (default: one at a time)')
+    parser.add_argument('--engine', type=str, default='python', choices=['python', 'numpy'], help='Scoring engine, numpy scores whole postings lists with vectorized operations')
 
     args = parser.parse_args()
 
-    searcher = Searcher(args.files_folder)
+    searcher = Searcher(args.files_folder, args.engine, args.postings_cache_mb, args.results_cache_mb)
 
     if args.mode == 'interactive':
         searcher.interactive_mode(args.top_k,
@@ -315,7 +729,8 @@ if __name__ == "__main__":
                                   args.smart_notation,
                                   args.max_distance,
                                   args.k1,
-                                  args.b)
+                                  args.b,
+                                  args.proximity_boost)
     elif args.mode == 'batch':
         if not args.path_to_queries or not args.output_file:
             print("Batch mode requires path_to_queries and output_file arguments.")
@@ -328,6 +743,9 @@ if __name__ == "__main__":
                                 args.smart_notation,
                                 args.max_distance,
                                 args.k1,
-                                args.b)
+                                args.b,
+                                args.proximity_boost,
+                                args.batch_size)
             
+    print("Cache: ", searcher.cache_stats())
     print("Execution Time: ", time() - start_time)
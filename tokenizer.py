@@ -1,6 +1,11 @@
-from re import match, findall
+import re
+from functools import lru_cache
+from types import SimpleNamespace
 from Stemmer import Stemmer
 
+# number of distinct words whose stem is remembered, most words of a collection repeat often
+STEM_CACHE_SIZE = 1 << 18
+
 class Tokenizer:
 
     def __init__(self, args) -> None:
@@ -12,36 +17,69 @@ class Tokenizer:
 
         self.positional = args.indexer.storing.store_term_position
 
-        self.stopwords = []
+        # without minL every word is kept, whatever its length
+        self.min_length = int(self.minL) if self.minL != None else 0
+        self.pattern = re.compile(self.regular_exp)
+
+        self.stopwords = set()
         
         if self.stopwords_path != None:
             with open(self.stopwords_path, "r", encoding="utf-8") as f:
-                self.stopwords = set([w.strip().lower() for w in f.readlines() if len(w.strip()) >= self.minL])
+                self.stopwords = set([w.strip().lower() for w in f.readlines() if len(w.strip()) >= self.min_length])
             f.close()
 
+        self.stemmer_name = self.stemmer
         self.stemmer = Stemmer('english') if self.stemmer == 'pystemmer' else None
+        self.stem = lru_cache(maxsize=STEM_CACHE_SIZE)(self.stemmer.stemWord) if self.stemmer != None else None
         print("\nTokenizer initialized...\n")
 
-    def tokenize(self, content : str) -> list:
+    def config(self) -> dict:
+        """Settings needed to build the same tokenizer again, stored by the indexer in docs_info.txt."""
+        return {
+            "lowercase": self.lowercase,
+            "minL": self.minL,
+            "regular_exp": self.regular_exp,
+            "stemmer": self.stemmer_name,
+            "stopwords_path": self.stopwords_path,
+        }
 
-        words = findall(self.regular_exp, content)
+    @staticmethod
+    def from_config(config : dict, positional : bool):
+        """Tokenizer with the settings returned by config (as strings, like they are read from docs_info.txt)."""
+        optional = lambda value: None if value in (None, "None") else value
+        tokenizer_args = SimpleNamespace(
+            lowercase=config["lowercase"] in (True, "True"),
+            minL=optional(config["minL"]),
+            regular_exp=config["regular_exp"],
+            stemmer=optional(config["stemmer"]),
+            stopwords_path=optional(config["stopwords_path"]),
+        )
+        if tokenizer_args.minL is not None:
+            tokenizer_args.minL = int(tokenizer_args.minL)
+        args = SimpleNamespace(tokenizer=tokenizer_args, indexer=SimpleNamespace(storing=SimpleNamespace(store_term_position=positional)))
+        return Tokenizer(args)
 
+    def words(self, content : str) -> list:
+        """Words matched by the regular expression, lowercased (if set) as a whole string first."""
         if self.lowercase == True:
-            words = [word.lower() for word in words]
-        
-        if self.regular_exp != '<complete with regular expression>':
-            words = [word for word in words if match(self.regular_exp, word)]
-        
-        if self.minL != None:
-            words = [word for word in words if len(word) >= int(self.minL)]
-        
-        
-        if self.stopwords != []:
-            words = [word for word in words if word not in self.stopwords]
-        
-        # if self.stemmer != None:
-        #     words = [self.stemmer.stemWord(word) for word in words]
+            content = content.lower()
+        return self.pattern.findall(content)
 
-            
-        return words
-    
+    def normalize(self, word : str):
+        """
+        The term a word returned by words becomes, or None if it is discarded,
+        following the same steps as tokenize.
+        """
+        if len(word) < self.min_length or word in self.stopwords:
+            return None
+        return self.stem(word) if self.stem != None else word
+
+    def tokenize(self, content : str) -> list:
+        # one pass over the words: minimum length and stopwords are checked together and the
+        # stems come from a cache, instead of building a new list for every step
+        min_length = self.min_length
+        stopwords = self.stopwords
+        if self.stem == None:
+            return [word for word in self.words(content) if len(word) >= min_length and word not in stopwords]
+        stem = self.stem
+        return [stem(word) for word in self.words(content) if len(word) >= min_length and word not in stopwords]
@@ -0,0 +1,60 @@
+"""
+NumPy helpers for the vectorized scoring engine of the searcher (--engine numpy).
+
+Each postings list is turned into a pair of arrays (doc ids, frequencies), the
+weights of a whole term are computed in one expression and added into a dense
+float32 accumulator with one score per document.
+"""
+import numpy as np
+
+from codec import read_skips, decode_postings
+
+
+def varint_decode_array(data):
+    """Decodes a sequence of variable-byte integers into an int64 array, without a python loop per number."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 128)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    numbers = np.zeros(len(ends), dtype=np.int64)
+    # a number spans at most a handful of bytes, so the loop is over byte positions, not numbers
+    for i in range(int(lengths.max()) if len(ends) else 0):
+        has_byte = lengths > i
+        numbers[has_byte] |= (data[starts[has_byte] + i] & 127).astype(np.int64) << (7 * i)
+    return numbers
+
+
+def postings_arrays(data, positional, format):
+    """(doc_ids, freqs) arrays of the encoded postings of a term."""
+    if format == "varint" and not positional:
+        # the blocks are contiguous and only hold (doc gap, freq) pairs, the first gap of a block
+        # being relative to the last doc id of the previous one, so a cumulative sum of the gaps
+        # of all blocks gives the doc ids
+        _, skips = read_skips(data)
+        if not skips:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        numbers = varint_decode_array(data[skips[0][1]:skips[-1][2]]).reshape(-1, 2)
+        return np.cumsum(numbers[:, 0]), numbers[:, 1]
+
+    postings = decode_postings(data, positional, format)
+    doc_ids = np.fromiter((doc_id for doc_id, _, _ in postings), dtype=np.int64, count=len(postings))
+    freqs = np.fromiter((freq for _, _, freq in postings), dtype=np.int64, count=len(postings))
+    return doc_ids, freqs
+
+
+def top_documents(scores, doc_ids, top_k=None):
+    """
+    The top_k (doc_id, score) pairs among doc_ids, best first, ties going to the smallest
+    doc id, like Searcher.top_documents.
+    """
+    if len(doc_ids) == 0:
+        return []
+    doc_ids = np.unique(np.concatenate(doc_ids))
+    doc_scores = scores[doc_ids]
+    if top_k is not None and 0 < top_k < len(doc_ids):
+        # keep every document tied with the k-th score, the order below picks among them
+        kth_score = np.partition(doc_scores, len(doc_scores) - top_k)[len(doc_scores) - top_k]
+        keep = doc_scores >= kth_score
+        doc_ids, doc_scores = doc_ids[keep], doc_scores[keep]
+    order = np.lexsort((doc_ids, -doc_scores))[:top_k]
+    return [(int(doc_id), float(score)) for doc_id, score in zip(doc_ids[order], doc_scores[order])]